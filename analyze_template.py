@@ -1,51 +1,236 @@
 """
 Script para analisar o template DOCX e identificar placeholders.
+
+Uso: python analyze_template.py [arquivo.docx | diretório]
+Quando um diretório é informado, todos os .docx são analisados em paralelo.
 """
-from docx import Document
+import hashlib
+import os
+import pickle
+import re
+import sys
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
 from pathlib import Path
+from typing import Iterator
+
+# Placeholders no formato {{NOME}} (qualquer texto entre as chaves, ex: {{Nome do Aluno}});
+# o grupo captura o nome, sem os espaços das bordas
+_PH_RE = re.compile(r'\{\{([^}]+)\}\}')
+
+# Namespace WordprocessingML; tags no formato Clark usados pelo lxml
+_W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_W = f'{{{_W_NS}}}'
+_W_P = f'{_W}p'
+_W_STYLE = f'{_W}style'
+_W_SECT_PR = f'{_W}sectPr'
+_W_P_SECT_PR_PATH = f'{_W}pPr/{_W}sectPr'
+_W_P_STYLE_PATH = f'{_W}pPr/{_W}pStyle'
+_W_T = f'{_W}t'
+_W_BR = f'{_W}br'
+# Conteúdo de texto de todos os runs do parágrafo, inclusive dentro de hyperlink,
+# smartTag, ins e fldSimple (ignora caixas de texto aninhadas)
+_P_TEXT_XPATH = etree.XPath(
+    './/w:r[not(ancestor::w:txbxContent)]/*[self::w:t or self::w:tab or self::w:ptab'
+    ' or self::w:br or self::w:cr or self::w:noBreakHyphen]',
+    namespaces={'w': _W_NS},
+)
+# Equivalente em texto dos elementos de run, como no python-docx (w:t e w:br à parte)
+_RUN_CHARS = {f'{_W}tab': '\t', f'{_W}ptab': '\t', f'{_W}cr': '\n', f'{_W}noBreakHyphen': '-'}
+
+# Nomes internos de estilos embutidos -> nomes exibidos pelo Word
+_STYLE_ALIASES = {
+    'caption': 'Caption', 'footer': 'Footer', 'header': 'Header',
+    'title': 'Title', 'subtitle': 'Subtitle', 'body text': 'Body Text',
+    **{f'heading {n}': f'Heading {n}' for n in range(1, 10)},
+}
+
+# Limite de caracteres exibidos por parágrafo na estrutura
+DISPLAY_LIMIT = 60
+
+# Cache dos relatórios, indexado pelo hash do conteúdo do template.
+# Incrementar CACHE_VERSION quando o formato do relatório mudar.
+CACHE_DIR = Path('.cache/analyze_template')
+CACHE_VERSION = 5
+
+
+def _load_paragraph_styles(styles_root) -> tuple[dict, str]:
+    """Retorna o mapa styleId -> nome e o nome do estilo de parágrafo padrão."""
+    names = {}
+    default_name = 'Normal'
+    if styles_root is None:
+        return names, default_name
+    for style_el in styles_root.iter(_W_STYLE):
+        if style_el.get(f'{_W}type') != 'paragraph':
+            continue
+        name_el = style_el.find(f'{_W}name')
+        name = name_el.get(f'{_W}val') if name_el is not None else style_el.get(f'{_W}styleId')
+        name = _STYLE_ALIASES.get(name, name)
+        names[style_el.get(f'{_W}styleId')] = name
+        if style_el.get(f'{_W}default') in ('1', 'true'):
+            default_name = name
+    return names, default_name
+
+
+def _paragraph_text(p_el) -> str:
+    """Texto do parágrafo, com tabulações e quebras de linha como no python-docx."""
+    parts = []
+    for el in _P_TEXT_XPATH(p_el):
+        tag = el.tag
+        if tag == _W_T:
+            parts.append(el.text or '')
+        elif tag == _W_BR:
+            # Só a quebra de linha vira '\n'; quebras de página/coluna não têm texto
+            if el.get(f'{_W}type', 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        else:
+            parts.append(_RUN_CHARS[tag])
+    return ''.join(parts)
+
+
+def analyze(template_path: Path) -> dict:
+    """Analisa o template e retorna placeholders, estrutura e contagens."""
+    # Leitura direta do XML: a análise não precisa do modelo completo do python-docx
+    with zipfile.ZipFile(template_path) as z:
+        root = etree.fromstring(z.read('word/document.xml'))
+        try:
+            styles_root = etree.fromstring(z.read('word/styles.xml'))
+        except KeyError:
+            styles_root = None
+    style_names, default_style = _load_paragraph_styles(styles_root)
+    body = root.find(f'{_W}body')
+
+    # Placeholders em listas paralelas (índice, estilo, texto) + nomes extraídos
+    ph_indices = []
+    ph_styles = []
+    ph_texts = []
+    ph_names = Counter()  # nome -> ocorrências, na ordem de aparição
+    structure_lines = []
+    # Percorre os <w:p> do corpo direto no lxml, sem criar um Paragraph por item
+    # Contagens feitas durante a travessia; a seção final fica em body/sectPr
+    n_paragraphs = 0
+    n_sections = 1 if body.find(_W_SECT_PR) is not None else 0
+    for i, p_el in enumerate(body.iterchildren(_W_P)):
+        n_paragraphs += 1
+        if p_el.find(_W_P_SECT_PR_PATH) is not None:
+            n_sections += 1
+        # Fast path: parágrafos vazios (espaçadores) não geram saída
+        raw = _paragraph_text(p_el)
+        if not raw or raw.isspace():
+            continue
+        text = raw.strip()
+        p_style = p_el.find(_W_P_STYLE_PATH)
+        if p_style is None:
+            style = default_style
+        else:
+            style_id = p_style.get(f'{_W}val')
+            style = style_names.get(style_id, default_style)
+        # Gate barato com find: só roda o regex se houver '{{' seguido de '}}'
+        open_idx = text.find('{{')
+        if open_idx != -1 and text.find('}}', open_idx + 2) != -1:
+            match = _PH_RE.search(text, open_idx)
+        else:
+            match = None
+
+        if match:
+            ph_indices.append(i)
+            ph_styles.append(style)
+            ph_texts.append(text)
+            ph_names.update(name.strip() for name in _PH_RE.findall(text))
+
+        display_text = text if len(text) <= DISPLAY_LIMIT else f'{text[:DISPLAY_LIMIT]}...'
 
-template_path = Path('template/Template Docx.docx')
-doc = Document(template_path)
-
-print('=' * 60)
-print('ANÁLISE DO TEMPLATE DOCX')
-print('=' * 60)
-
-print('\n📌 PLACEHOLDERS ENCONTRADOS:')
-placeholders = []
-for i, para in enumerate(doc.paragraphs):
-    text = para.text.strip()
-    if '{{' in text and '}}' in text:
-        placeholders.append({
-            'index': i,
-            'style': para.style.name,
-            'text': text
-        })
-        print(f'  [{i}] Estilo: "{para.style.name}"')
-        print(f'       Texto: "{text}"')
-        print()
-
-if not placeholders:
-    print('  Nenhum placeholder encontrado!')
-
-print('\n📄 ESTRUTURA DO DOCUMENTO:')
-for i, para in enumerate(doc.paragraphs):
-    text = para.text.strip()
-    if text:
-        display_text = text[:60] + '...' if len(text) > 60 else text
-        style = para.style.name
-        
         # Destacar placeholders
-        if '{{' in text:
-            print(f'  🔹 [{i}] {style}: {display_text}')
-        elif 'Heading' in style or 'Title' in style:
-            print(f'  📗 [{i}] {style}: {display_text}')
+        if match:
+            structure_lines.append(f'  🔹 [{i}] {style}: {display_text}')
+        elif style.startswith(('Heading', 'Title')):
+            structure_lines.append(f'  📗 [{i}] {style}: {display_text}')
         else:
-            print(f'     [{i}] {style}: {display_text}')
-
-print('\n📊 RESUMO:')
-print(f'  Total de parágrafos: {len(doc.paragraphs)}')
-print(f'  Total de seções: {len(doc.sections)}')
-print(f'  Placeholders: {len(placeholders)}')
-for p in placeholders:
-    print(f'    - {p["text"]}')
+            structure_lines.append(f'     [{i}] {style}: {display_text}')
+
+    return {
+        'ph_indices': ph_indices,
+        'ph_styles': ph_styles,
+        'ph_texts': ph_texts,
+        'ph_names': ph_names,
+        'structure_lines': structure_lines,
+        'n_paragraphs': n_paragraphs,
+        'n_sections': n_sections,
+    }
+
+
+def analyze_cached(template_path: Path) -> dict:
+    """
+    Retorna o relatório do template, reaproveitando o cache em disco
+    enquanto o conteúdo do arquivo não mudar.
+    """
+    key = hashlib.sha1(template_path.read_bytes()).hexdigest()[:16]
+    cache_file = CACHE_DIR / f'v{CACHE_VERSION}-{key}.pkl'
+
+    if cache_file.exists():
+        try:
+            with cache_file.open('rb') as f:
+                return pickle.load(f)
+        except Exception:
+            pass  # Cache corrompido: refaz a análise
+
+    report = analyze(template_path)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with cache_file.open('wb') as f:
+            pickle.dump(report, f)
+    except OSError:
+        pass  # Cache é opcional
+    return report
+
+
+def iter_report(report: dict) -> Iterator[str]:
+    """Gera as linhas do relatório de análise, já terminadas em quebra de linha."""
+    ph_texts = report['ph_texts']
+
+    yield '=' * 60 + '\n'
+    yield 'ANÁLISE DO TEMPLATE DOCX\n'
+    yield '=' * 60 + '\n'
+
+    yield '\n📌 PLACEHOLDERS ENCONTRADOS:\n'
+    for index, style, text in zip(report['ph_indices'], report['ph_styles'], ph_texts):
+        yield f'  [{index}] Estilo: "{style}"\n'
+        yield f'       Texto: "{text}"\n'
+        yield '\n'
+
+    if not ph_texts:
+        yield '  Nenhum placeholder encontrado!\n'
+
+    yield '\n📄 ESTRUTURA DO DOCUMENTO:\n'
+    for line in report['structure_lines']:
+        yield f'{line}\n'
+
+    yield '\n📊 RESUMO:\n'
+    yield f'  Total de parágrafos: {report["n_paragraphs"]}\n'
+    yield f'  Total de seções: {report["n_sections"]}\n'
+    yield f'  Placeholders: {len(ph_texts)}\n'
+    # Nomes repetidos aparecem uma única vez, com a contagem
+    for name, count in report['ph_names'].items():
+        suffix = f' ({count}x)' if count > 1 else ''
+        yield f'    - {{{{{name}}}}}{suffix}\n'
+
+
+def main(argv: list[str]) -> None:
+    target = Path(argv[1]) if len(argv) > 1 else Path('template/Template Docx.docx')
+
+    # O relatório é consumido direto pelo writelines, sem lista intermediária
+    if target.is_dir():
+        template_paths = sorted(target.glob('*.docx'))
+        # A análise é CPU-bound (lxml); processos escalam melhor que threads
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for path, report in zip(template_paths, executor.map(analyze_cached, template_paths)):
+                sys.stdout.write(f'\n📁 {path}\n')
+                sys.stdout.writelines(iter_report(report))
+    else:
+        sys.stdout.writelines(iter_report(analyze_cached(target)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
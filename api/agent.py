@@ -1,16 +1,24 @@
 import os
 import tempfile
-from typing import Dict, List, Tuple, Any, TypedDict, Optional
-import json
+from typing import Annotated, Dict, List, Tuple, Any, TypedDict, Optional
+import orjson
 from pathlib import Path
 import logging
 import re
+import mistune
+import random
+import sqlite3
+import threading
+import uuid
 from dotenv import load_dotenv
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 
 # Bibliotecas para LangGraph
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.config import get_stream_writer
 import langchain
 
 # Bibliotecas para Gemini/Vertex AI
@@ -22,15 +30,22 @@ if USE_VERTEXAI:
     from vertexai.generative_models import GenerativeModel
     import vertexai
 else:
-    import google.generativeai as genai
+    # Gemini API via REST, sobre um pool HTTP/2 compartilhado
+    from api.gemini_client import GeminiRestModel
 
 # Biblioteca para exportação
 import docx
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+from docx.oxml.ns import qn, nsdecls
+from docx.oxml import OxmlElement, parse_xml
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.oxml.table import CT_Tbl
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from api.llm_cache import TextResponse, LLMCache, get_llm_cache
+from api.rate_limiter import get_rate_limiter
 
 load_dotenv()
 
@@ -44,20 +59,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Geração paralela de capítulos: cada capítulo usa o sumário completo como contexto,
+# então todos podem ser escritos ao mesmo tempo. Com PARALLEL_CHAPTERS=false o modo
+# sequencial (com resumo do capítulo anterior no prompt) é mantido.
+PARALLEL_CHAPTERS = os.getenv("PARALLEL_CHAPTERS", "true").lower() == "true"
+CHAPTER_CONCURRENCY = int(os.getenv("CHAPTER_CONCURRENCY", "4"))
+# Tamanho do resumo do capítulo anterior usado como contexto. Só vale no modo
+# sequencial (PARALLEL_CHAPTERS=false): no modo paralelo, o padrão, write_all_chapters
+# não grava "summary" e os prompts usam apenas o sumário completo do livro
+CHAPTER_SUMMARY_CHARS = 500
+
+# Checkpoints do LangGraph em SQLite (modo WAL): cada passo grava apenas os canais
+# alterados, em vez de manter todo o estado em memória. A thread de cada geração é
+# apagada ao final (agent_book_generator), então o arquivo não acumula livros antigos
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(tempfile.gettempdir(), "booklm-ckpt.db"))
+
+_checkpointer: Optional[SqliteSaver] = None
+_checkpointer_lock = threading.Lock()
+
+def get_checkpointer() -> SqliteSaver:
+    """Retorna o checkpointer SQLite compartilhado, criando a conexão na primeira chamada."""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _checkpointer = SqliteSaver(conn)
+            logger.info(f"Checkpoints do agente em: {CHECKPOINT_DB_PATH}")
+        return _checkpointer
+
+# Modelos por tipo de tarefa: título/sumário usam um modelo rápido e a escrita e
+# revisão dos capítulos usam o modelo de maior qualidade (padrão: GEMINI_MODEL)
+GEMINI_MODEL_FAST = os.getenv("GEMINI_MODEL_FAST") or os.getenv("GEMINI_MODEL")
+GEMINI_MODEL_QUALITY = os.getenv("GEMINI_MODEL_QUALITY") or os.getenv("GEMINI_MODEL")
+
 # Inicializar Gemini API
-def init_gemini_api():
+def init_gemini_api(model_name: Optional[str] = None):
     """Inicializa a conexão com o Gemini API."""
     logger.info("Inicializando Gemini API...")
-    import google.generativeai as genai
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    return genai.GenerativeModel(os.getenv("GEMINI_MODEL"))
+    return GeminiRestModel(model_name or os.getenv("GEMINI_MODEL"), api_key=os.getenv("GEMINI_API_KEY"))
 
-def init_vertex_ai():
+def init_vertex_ai(model_name: Optional[str] = None):
     """Inicializa a conexão com o Vertex AI usando credenciais do ambiente."""
     logger.info("Inicializando Vertex AI...")
-    from google.cloud import aiplatform
-    from vertexai.generative_models import GenerativeModel
-    import vertexai
     
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     location = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
@@ -68,36 +113,65 @@ def init_vertex_ai():
     vertexai.init(project=project_id, location=location)
     
     # Modelo no Vertex AI
-    return GenerativeModel(os.getenv("GEMINI_MODEL"))
+    return GenerativeModel(model_name or os.getenv("GEMINI_MODEL"))
 
-def get_model():
+# Uma instância por nome de modelo no processo: as gerações seguintes reaproveitam
+# o cliente (e seu pool de conexões) em vez de reinicializar o backend
+@lru_cache(maxsize=4)
+def get_model(model_name: Optional[str] = None):
     """Retorna o modelo correto baseado na variável USE_VERTEXAI."""
     if USE_VERTEXAI:
         logger.info("Usando Vertex AI como backend")
-        return init_vertex_ai()
+        return init_vertex_ai(model_name)
     else:
         logger.info("Usando Gemini API como backend")
-        return init_gemini_api()
+        return init_gemini_api(model_name)
+
+def get_models() -> Dict[str, Any]:
+    """Retorna os modelos por tipo de tarefa: "fast" (título/sumário) e "quality" (capítulos/revisão)."""
+    fast = get_model(GEMINI_MODEL_FAST)
+    quality = fast if GEMINI_MODEL_QUALITY == GEMINI_MODEL_FAST else get_model(GEMINI_MODEL_QUALITY)
+    logger.info(f"Modelos: rápido={GEMINI_MODEL_FAST}, qualidade={GEMINI_MODEL_QUALITY}")
+    return {"fast": fast, "quality": quality}
 
 # Função auxiliar para parsing seguro de JSON
+# Remove cercas de código Markdown (```json ... ```) em uma única passada
+_JSON_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*\n?(.*?)\n?```\s*$', re.DOTALL)
+
 def safe_json_parse(response_text: str, fallback: Any) -> Any:
     """Tenta decodificar JSON e retorna um fallback em caso de erro."""
-    if response_text.startswith("```json"):
-        response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-    elif response_text.startswith("```"):
-        response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
+    match = _JSON_FENCE_RE.match(response_text)
+    if match:
+        response_text = match.group(1)
     
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError:
+        return orjson.loads(response_text)
+    except orjson.JSONDecodeError:
         logger.error(f"Erro ao decodificar JSON: {response_text[:100]}... Usando fallback.")
         return fallback
 
+# Padrões Markdown usados na exportação com template (compilados uma única vez)
+_MD_ORDERED_RE = re.compile(r'^\s*\d+\.\s+')
+_MD_BULLET_RE = re.compile(r'^\s*[-*+]\s+')
+# Estilo de título por nível de '#' (índice 0 não é usado)
+_HEADING_STYLE_NAMES = tuple(f'Heading {level}' for level in range(7))
+# Uma alternância com grupos nomeados: o tipo do trecho vem de match.lastgroup
+_MD_INLINE_TEMPLATE_RE = re.compile(
+    r'(?P<bi>\*\*\*(?P<bi_text>.+?)\*\*\*)'
+    r'|(?P<b>\*\*(?P<b_text>.+?)\*\*)'
+    r'|(?P<i>\*(?P<i_text>.+?)\*)'
+    r'|(?P<s>~~(?P<s_text>.+?)~~)'
+    r'|(?P<u>_(?P<u_text>.+?)_)'
+    r'|(?P<lnk>\[(?P<lnk_text>.+?)\]\((?P<lnk_url>.+?)\))'
+)
+
 # Definição dos estados do grafo
+def _merge_chapters(current: Dict[int, Dict[str, str]], update: Dict[int, Dict[str, str]]) -> Dict[int, Dict[str, str]]:
+    """Reducer do canal `chapters`: os nós retornam só os capítulos alterados."""
+    merged = dict(current or {})
+    merged.update(update)
+    return merged
+
 class BookState(TypedDict, total=False):
     theme: str
     title: str
@@ -106,103 +180,150 @@ class BookState(TypedDict, total=False):
     author_name: str
     num_chapters: int
     outline: List[Dict[str, Any]]
-    chapters: Dict[int, Dict[str, str]]
+    # Atualizações parciais são mescladas pelo LangGraph (sem copiar o dict inteiro a cada capítulo)
+    chapters: Annotated[Dict[int, Dict[str, str]], _merge_chapters]
     current_chapter: int
     status: str
     feedback: str
     export_path: str
     feedback_path: str
+    # Diretório onde o DOCX é salvo (padrão: diretório temporário do sistema)
+    export_dir: str
+
+# ===== PROMPTS =====
+# Cada prompt começa com um bloco fixo (persona + instruções) e termina com os dados
+# variáveis. Como o cache de contexto do Gemini reaproveita prefixos idênticos,
+# manter o trecho estático no início permite que ele seja cobrado/processado uma vez
+# e reutilizado entre chamadas (em especial entre os N capítulos).
+
+PROMPT_PLAN = """
+    Você é um especialista técnico elaborando um livro técnico para estudo de um determinado tema.
+    Baseado no tema, área tecnológica, público-alvo e número de capítulos informados ao final, gere o título e o sumário do livro.
+
+    TÍTULO:
+    - Sugira um título formal e técnico que reflita um enfoque analítico e informativo.
+    - O Título deve ter no máximo 80 caracteres. Caracteres inválidos para o título: , \\ / : * ? " < > |
+
+    SUMÁRIO:
+    - Crie um sumário detalhado e com foco em aspectos técnicos e práticos.
+    - Cada capítulo deve ter uma numeração inteira e sequencial (exemplo: 1, 2, 3, 4, 5, etc.)
+    - O sumário deve conter exatamente o número de capítulos informado, cada um abordando um aspecto técnico ou prático do tema, com títulos objetivos e descrições que detalhem o conteúdo analítico a ser explorado.
+
+    Responda SOMENTE em formato JSON com a chave "title" e a chave "outline", esta com uma lista de objetos contendo "chapter_number", "chapter_title" e "chapter_description", sem texto adicional.
+    Exemplo: {"title": "Fundamentos de Exploração Espacial", "outline": [{"chapter_number": 1, "chapter_title": "Princípios de Propulsão Espacial", "chapter_description": "Análise dos sistemas de propulsão usados em missões espaciais"}]}
+    Não inclua bloco de código, ou seja ```json```
+    """
 
-# Funções para cada etapa do processo
-def get_book_info(state: BookState, model) -> Dict[str, Any]:
-    """Obtém informações básicas e gera o título com base no tema."""
-    logger.info(f"Estado recebido em get_book_info: {state}")
-    logger.info("Coletando informações básicas do livro...")
-    updates = {}
+PERSONA_WRITER = """
+    Você é um especialista técnico escrevendo um capítulo de um livro técnico. Os dados do livro e do capítulo são informados ao final.
+    """
+
+STYLE_INSTRUCTIONS = """
+    INSTRUÇÕES IMPORTANTES:
+    - Comece DIRETAMENTE com o conteúdo do capítulo, SEM introduções como "Segue o capítulo...", "Com certeza...", "Aqui está..." ou qualquer preâmbulo.
+    - NÃO repita o título do livro, área tecnológica ou público-alvo no início do capítulo.
+    - NÃO inclua linhas separadoras (---) no início.
+    - Inicie imediatamente com a primeira seção ou parágrafo do conteúdo técnico.
     
+    FORMATO DO CONTEÚDO:
+    - Escreva um texto técnico e analítico, com linguagem formal e objetiva.
+    - Inclua informações técnicas detalhadas, exemplos contextualizados (reais ou hipotéticos), dados relevantes e explicações claras.
+    - Evite diálogos narrativos ou descrições literárias excessivas.
+    - Estruture o conteúdo com seções claras (ex.: introdução, desenvolvimento, análise, exemplos, conclusão).
+    - O capítulo deve ter pelo menos 3000 palavras.
+    - Seja o mais detalhista e técnico possível e aborde o tema do capítulo com profundidade técnica e bastante exemplos.
+    - Estruture o capítulo com títulos e subtítulos para facilitar a leitura e compreensão do conteúdo.
+    - Siga a numeração do capítulo e estruture os subtítulos com base na numeração do capítulo (ex: para o capítulo N, use N.1, N.2, etc).
+    """
+
+PERSONA_EDITOR = """
+    Você é um editor revisando um livro técnico, cujos dados e sumário são informados ao final.
+    Forneça feedback sobre estrutura, fluxo narrativo, consistência com o tema e apelo ao público-alvo. Seja minucioso referente às informações técnicas e sugira melhorias. Revise tecnicamente o livro e verifique se há alguma inconsistência.
+    Traga sugestões de melhorias, correções e ajustes necessários, indicando os capítulos e seções específicas para correção.
+    """
+
+# Funções para cada etapa do processo
+def plan_book(state: BookState, model) -> Dict[str, Any]:
+    """Gera o título e o sumário do livro em uma única chamada ao modelo."""
+    logger.info(f"Estado recebido em plan_book: {state}")
+    logger.info("Gerando título e sumário do livro...")
+
     theme = state.get("theme", "Um tema genérico")
     area_tecnologica = state.get("area_tecnologica", "Não especificada")
     target_audience = state.get("target_audience", "Adultos")
-    
-    updates["theme"] = theme
-    updates["area_tecnologica"] = area_tecnologica
-    updates["target_audience"] = target_audience
-    
-    prompt = f"""
-    Você é um especialista em redação técnica. Baseado no seguinte tema, área tecnológica e público-alvo, sugira um título formal e técnico que reflita um enfoque analítico e informativo:
+    num_chapters = state.get("num_chapters", 5)
+
+    # Título e sumário dependem apenas dos mesmos dados de entrada: um único pedido
+    # evita uma ida e volta ao modelo e envia o preâmbulo uma só vez
+    prompt = f"""{PROMPT_PLAN}
     Tema: {theme}
     Área Tecnológica: {area_tecnologica}
     Público-Alvo: {target_audience}
-    Responda SOMENTE em formato JSON com a chave "title", sem texto adicional. Exemplo: {{"title": "Fundamentos de Exploração Espacial"}}. Não inclua bloco de código, ou seja ```json```
-    O Título deve ter no máximo 80 caracteres. Caracteres inválidos para o título: , \\ / : * ? " < > |
-    """
-    
-    logger.info("Gerando título com base no tema...")
-    response = generate_with_retry(model, prompt)
-    logger.debug(f"Resposta bruta do modelo: {response.text}")
-    info = safe_json_parse(response.text, {"title": f"Livro sobre {theme}"})
-    updates["title"] = info.get("title", f"Livro sobre {theme}")
-    logger.info(f"Título gerado: {updates['title']}")
-    
-    updates["status"] = "book_info_collected"
-    logger.debug(f"Atualizações de get_book_info: {updates}")
-    return updates
-
-def create_outline(state: BookState, model) -> Dict[str, Any]:
-    """Cria o sumário do livro baseado nas informações fornecidas."""
-    logger.info("Criando sumário do livro...")
-    
-    prompt = f"""
-    Você é um especialista técnico no tema {state['theme']}, elaborando um livro técnico para estudo de um determinado tema. 
-    Baseado nas seguintes informações, crie um sumário detalhado e com foco em aspectos técnicos e práticos:
-    
-    Tema: {state['theme']}
-    Título sugerido: {state['title']}
-    Área Tecnológica: {state.get('area_tecnologica', 'Não especificada')}
-    Público-Alvo: {state['target_audience']}
-    
-    Cada capítulo deve ter uma numeração inteira e sequencial (exemplo: 1, 2, 3, 4, 5, etc.)
-
-    O sumário deve conter exatamente {state['num_chapters']} capítulos, cada um abordando um aspecto técnico ou prático do tema, com títulos objetivos e descrições que detalhem o conteúdo analítico a ser explorado.
-    Responda SOMENTE em formato JSON com uma lista de objetos contendo "chapter_number", "chapter_title" e "chapter_description".
-    Exemplo: [{{"chapter_number": 1, "chapter_title": "Princípios de Propulsão Espacial", "chapter_description": "Análise dos sistemas de propulsão usados em missões espaciais"}}]
-    Não inclua bloco de código, ou seja ```json```
+    Número de capítulos: {num_chapters}
     """
 
     response = generate_with_retry(model, prompt)
     if not response:
-        logger.error("Falha ao gerar sumário.")
-        return {"status": "error", "message": "Falha ao gerar sumário."}
+        logger.error("Falha ao gerar título e sumário.")
+        return {"status": "error", "message": "Falha ao gerar título e sumário."}
 
     logger.debug(f"Resposta bruta do modelo: {response.text}")
-    outline_data = safe_json_parse(response.text, [
-        {"chapter_number": 1, "chapter_title": "Introdução", 
-         "chapter_description": f"Exploração inicial do tema {state['theme']}."}
-    ])
-    
-    num_chapters = state.get("num_chapters", 5)
+    plan = safe_json_parse(response.text, {})
+    if not isinstance(plan, dict):
+        plan = {}
+
+    title = plan.get("title") or f"Livro sobre {theme}"
+    logger.info(f"Título gerado: {title}")
+
+    outline_data = plan.get("outline") or [
+        {"chapter_number": 1, "chapter_title": "Introdução",
+         "chapter_description": f"Exploração inicial do tema {theme}."}
+    ]
     if len(outline_data) < num_chapters:
         logger.warning(f"Sumário com menos de {num_chapters} capítulos. Adicionando capítulos extras.")
         for i in range(len(outline_data) + 1, num_chapters + 1):
             outline_data.append({
                 "chapter_number": i,
                 "chapter_title": f"Capítulo {i}",
-                "chapter_description": f"Continuação da exploração de {state['theme']}."
+                "chapter_description": f"Continuação da exploração de {theme}."
             })
-    
+
     updates = {
+        "theme": theme,
+        "area_tecnologica": area_tecnologica,
+        "target_audience": target_audience,
+        "title": title,
         "outline": outline_data,
-        "chapters": {item["chapter_number"]: {"title": item["chapter_title"], 
+        # Capítulos inseridos em ordem numérica uma única vez: o dict preserva a ordem
+        # de inserção (inclusive no merge do reducer), então a exportação não reordena
+        "chapters": {item["chapter_number"]: {"title": item["chapter_title"],
                                               "description": item["chapter_description"],
-                                              "content": ""} 
-                     for item in outline_data},
+                                              "content": ""}
+                     for item in sorted(outline_data, key=lambda item: item["chapter_number"])},
         "current_chapter": 1,
-        "status": "outline_created"
+        "status": "planned"
     }
     logger.info(f"Sumário criado com {len(outline_data)} capítulos.")
     logger.info(f"Capítulos gerados: {updates['chapters']}")
     return updates
 
+def build_chapter_prompt(state: BookState, current: int, context: str = "") -> str:
+    """Monta o prompt de escrita do capítulo `current` com o contexto informado."""
+    chapter_info = state["chapters"][current]
+    # Dados do livro (iguais em todos os capítulos) antes dos dados do capítulo
+    return f"""{PERSONA_WRITER}{STYLE_INSTRUCTIONS}
+    Título do livro: "{state['title']}"
+    Tema: "{state['theme']}"
+    Área tecnológica: "{state.get('area_tecnologica', 'Não especificada')}"
+    Público-alvo: "{state['target_audience']}"
+    
+    {context}
+    
+    Escreva o Capítulo {current}: "{chapter_info['title']}".
+    
+    Descrição do capítulo: {chapter_info['description']}
+    """
+
 def write_chapter(state: BookState, model, st_session=None) -> Dict[str, Any]:
     """Escreve o conteúdo para o capítulo atual."""
     current = state["current_chapter"]
@@ -216,60 +337,76 @@ def write_chapter(state: BookState, model, st_session=None) -> Dict[str, Any]:
     logger.info(f"Escrevendo Capítulo {current}: {chapter_info['title']}...")
         
     prev_content = ""
-    if current > 1 and state["chapters"].get(current-1, {}).get("content"):
+    if current > 1 and state["chapters"].get(current-1, {}).get("summary"):
         prev_chapter = state["chapters"][current-1]
         prev_content = f"""
         Resumo do capítulo anterior ({current-1}: {prev_chapter['title']}):
-        {prev_chapter['content'][:500]}... (resumido)
+        {prev_chapter['summary']}... (resumido)
         """
     
-    prompt = f"""
-    Você é um especialista técnico escrevendo um livro intitulado "{state['title']}" com o tema "{state['theme']}".
-    A área tecnológica do livro é "{state.get('area_tecnologica', 'Não especificada')}", direcionado para o público "{state['target_audience']}"
-    
-    Escreva o Capítulo {current}: "{chapter_info['title']}".
-    
-    Descrição do capítulo: {chapter_info['description']}
-    
-    {prev_content}
-    
-    INSTRUÇÕES IMPORTANTES:
-    - Comece DIRETAMENTE com o conteúdo do capítulo, SEM introduções como "Segue o capítulo...", "Com certeza...", "Aqui está..." ou qualquer preâmbulo.
-    - NÃO repita o título do livro, área tecnológica ou público-alvo no início do capítulo.
-    - NÃO inclua linhas separadoras (---) no início.
-    - Inicie imediatamente com a primeira seção ou parágrafo do conteúdo técnico.
-    
-    FORMATO DO CONTEÚDO:
-    - Escreva um texto técnico e analítico, com linguagem formal e objetiva.
-    - Inclua informações técnicas detalhadas, exemplos contextualizados (reais ou hipotéticos), dados relevantes e explicações claras.
-    - Evite diálogos narrativos ou descrições literárias excessivas.
-    - Estruture o conteúdo com seções claras (ex.: introdução, desenvolvimento, análise, exemplos, conclusão).
-    - O capítulo deve ter pelo menos 3000 palavras.
-    - Seja o mais detalhista e técnico possível e aborde o tema do capítulo com profundidade técnica e bastante exemplos.
-    - Estruture o capítulo com títulos e subtítulos para facilitar a leitura e compreensão do conteúdo.
-    - Siga a numeração do capítulo e estruture os subtítulos com base na numeração do capítulo (ex: {current}.1, {current}.2, etc).
-    """
+    prompt = build_chapter_prompt(state, current, prev_content)
 
-    response = generate_with_retry(model, prompt)
+    # O texto é repassado em trechos enquanto o modelo gera (stream "custom" do
+    # LangGraph), em vez de só aparecer quando o capítulo inteiro estiver pronto
+    writer = get_stream_writer()
+
+    def on_chunk(text: str) -> None:
+        writer({"chapter": current, "text": text})
+        if st_session:
+            st_session.write(text)
+
+    response = generate_stream_with_retry(model, prompt, on_chunk)
 
     if not response:
         logger.error("Falha ao gerar conteúdo para o capítulo.")
         return {"status": "error", "message": "Falha ao gerar conteúdo para o capítulo."}
 
-    updated_chapters = state["chapters"].copy()
-    updated_chapters[current]["content"] = response.text
-    updates["chapters"] = updated_chapters
+    # Só o capítulo escrito volta no update; o reducer de `chapters` faz o merge.
+    # O resumo usado como contexto do próximo capítulo é gravado uma única vez aqui
+    # (apenas no modo sequencial; o modo paralelo não usa resumo).
+    updates["chapters"] = {current: {
+        **chapter_info,
+        "content": response.text,
+        "summary": response.text[:CHAPTER_SUMMARY_CHARS],
+    }}
     logger.info(f"Capítulo {current} concluído com sucesso.")
     
-    # Exibir o conteúdo gerado no Streamlit
-    if st_session:
-        # st_session.write(f"### Capítulo {current}: {chapter_info['title']}")
-        st_session.write(response.text)
-    time.sleep(5)
     updates["current_chapter"] = current + 1
     updates["status"] = "chapter_written" if updates["current_chapter"] <= len(state["chapters"]) else "all_chapters_written"
     return updates
 
+def write_all_chapters(state: BookState, model) -> Dict[str, Any]:
+    """Escreve todos os capítulos em paralelo, usando o sumário como contexto."""
+    chapters = state["chapters"]
+    chapter_numbers = list(chapters)
+    logger.info(f"Escrevendo {len(chapter_numbers)} capítulos em paralelo (até {CHAPTER_CONCURRENCY} simultâneos)...")
+
+    outline_context = "Sumário completo do livro (para manter a coerência entre os capítulos):\n" + "\n".join(
+        f"        Capítulo {num}: {data['title']} - {data['description']}"
+        for num, data in chapters.items()
+    )
+    prompts = [build_chapter_prompt(state, num, outline_context) for num in chapter_numbers]
+
+    # As chamadas ao modelo são bloqueantes (I/O de rede): um pool limitado de threads
+    # as executa simultaneamente, preservando a ordem dos resultados.
+    max_workers = max(1, min(CHAPTER_CONCURRENCY, len(prompts)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="write-chapter") as executor:
+        responses = list(executor.map(lambda prompt: generate_with_retry(model, prompt), prompts))
+
+    updated_chapters = {}
+    for num, response in zip(chapter_numbers, responses):
+        if not response:
+            logger.error(f"Falha ao gerar conteúdo para o capítulo {num}.")
+            return {"status": "error", "message": f"Falha ao gerar conteúdo para o capítulo {num}."}
+        updated_chapters[num] = {**chapters[num], "content": response.text}
+
+    logger.info(f"{len(updated_chapters)} capítulos concluídos com sucesso.")
+    return {
+        "chapters": updated_chapters,
+        "current_chapter": len(chapters) + 1,
+        "status": "all_chapters_written"
+    }
+
 def review_and_edit(state: BookState, model) -> Dict[str, Any]:
     """Revisa e edita o livro completo."""
     logger.info("Revisando e editando o livro...")
@@ -281,17 +418,13 @@ def review_and_edit(state: BookState, model) -> Dict[str, Any]:
     
     Sumário:
     """
-    for chapter_num, chapter_data in sorted(state["chapters"].items()):
-        book_summary += f"\nCapítulo {chapter_num}: {chapter_data['title']} - {chapter_data['description'][:100]}..."
-    
-    prompt = f"""
-    Você é um editor revisando o livro:
+    book_summary += "".join(
+        f"\nCapítulo {chapter_num}: {chapter_data['title']} - {chapter_data['description'][:100]}..."
+        for chapter_num, chapter_data in state["chapters"].items()
+    )
     
+    prompt = f"""{PERSONA_EDITOR}
     {book_summary}
-    
-    Forneça feedback sobre estrutura, fluxo narrativo, consistência com o tema "{state['theme']}" 
-    e apelo ao público-alvo. Seja minucioso referente às informações técnicas e sugira melhorias. Revise tecnicamente o livro e verifique se há alguma inconsistência.
-    Traga sugestões de melhorias, correções e ajustes necessários, indicando os capítulos e seções específicas para correção.
     """
 
     response = generate_with_retry(model, prompt)
@@ -319,6 +452,173 @@ def export_feedback(state: BookState) -> Dict[str, Any]:
     logger.info("Feedback processado (embutido no documento final).")
     return updates
 
+
+# ===== MARKDOWN -> DOCX =====
+# O Markdown é tokenizado em uma única passada pelo mistune (AST tipada) e cada
+# bloco é despachado para o emissor correspondente, sem regex por linha.
+_MARKDOWN_AST = mistune.create_markdown(renderer='ast', plugins=['strikethrough', 'table'])
+
+def _add_inline_runs(paragraph, children, bold=False, italic=False, strike=False, link=False):
+    """Adiciona os tokens inline (texto, negrito, itálico, links...) como runs do parágrafo."""
+    for child in children:
+        kind = child["type"]
+        if kind == "text":
+            run = paragraph.add_run(child["raw"])
+            if bold:
+                run.bold = True
+            if italic:
+                run.italic = True
+            if strike:
+                run.font.strike = True
+            if link:
+                # python-docx não suporta hiperlinks diretamente; URL é apenas visual
+                run.font.underline = True
+                run.font.color.rgb = RGBColor(0, 0, 255)
+        elif kind == "strong":
+            _add_inline_runs(paragraph, child["children"], True, italic, strike, link)
+        elif kind == "emphasis":
+            _add_inline_runs(paragraph, child["children"], bold, True, strike, link)
+        elif kind == "strikethrough":
+            _add_inline_runs(paragraph, child["children"], bold, italic, True, link)
+        elif kind == "link":
+            _add_inline_runs(paragraph, child["children"], bold, italic, strike, True)
+        elif kind == "codespan":
+            run = paragraph.add_run(child["raw"])
+            run.font.name = 'Courier New'
+        elif kind == "softbreak":
+            paragraph.add_run(" ")
+        elif kind == "linebreak":
+            paragraph.add_run().add_break(docx.enum.text.WD_BREAK.LINE)
+        elif "children" in child:
+            _add_inline_runs(paragraph, child["children"], bold, italic, strike, link)
+        elif "raw" in child:
+            paragraph.add_run(child["raw"])
+
+class _BlockBuffer:
+    """
+    Monta parágrafos e tabelas desanexados do documento e os insere no corpo
+    de uma só vez em flush(), em vez de uma mutação da árvore por bloco.
+    Expõe o subconjunto de Document usado pelos emissores (add_paragraph,
+    add_heading, add_table).
+    """
+
+    def __init__(self, doc: Document):
+        self._doc = doc
+        self._parent = doc._body
+        self._elements = []
+        self._style_ids = {}
+        self._block_width = None
+
+    def _style_id(self, style_name: str) -> str:
+        # Resolve o styleId uma vez por nome; o pStyle é gravado direto no XML
+        if style_name not in self._style_ids:
+            self._style_ids[style_name] = self._doc.styles[style_name].style_id
+        return self._style_ids[style_name]
+
+    def add_paragraph(self, style: Optional[str] = None) -> Paragraph:
+        p = OxmlElement('w:p')
+        if style:
+            p.get_or_add_pPr().style = self._style_id(style)
+        self._elements.append(p)
+        return Paragraph(p, self._parent)
+
+    def add_heading(self, level: int = 1) -> Paragraph:
+        return self.add_paragraph("Title" if level == 0 else f"Heading {level}")
+
+    def add_table(self, rows: int, cols: int) -> Table:
+        if self._block_width is None:
+            self._block_width = self._doc._block_width
+        tbl = CT_Tbl.new_tbl(rows, cols, self._block_width)
+        self._elements.append(tbl)
+        return Table(tbl, self._parent)
+
+    def flush(self) -> None:
+        """Insere os blocos acumulados no fim do corpo (antes do sectPr final)."""
+        if not self._elements:
+            return
+        body = self._doc.element.body
+        sect_pr = body.sectPr
+        idx = body.index(sect_pr) if sect_pr is not None else len(body)
+        body[idx:idx] = self._elements
+        self._elements = []
+
+def _emit_heading(blocks, token):
+    paragraph = blocks.add_heading(level=min(token["attrs"]["level"], 6))
+    _add_inline_runs(paragraph, token["children"])
+
+def _emit_paragraph(blocks, token):
+    _add_inline_runs(blocks.add_paragraph(), token["children"])
+
+def _emit_code(blocks, token):
+    code_paragraph = blocks.add_paragraph()
+    code_paragraph.paragraph_format.left_indent = Inches(0.5)
+    code_paragraph.paragraph_format.right_indent = Inches(0.5)
+    run = code_paragraph.add_run(token["raw"].rstrip('\n'))
+    run.font.name = 'Courier New'
+    run.font.size = Pt(10)
+    run.font.color.rgb = RGBColor(50, 50, 50)
+
+def _emit_quote(blocks, token):
+    for child in token["children"]:
+        quote_paragraph = blocks.add_paragraph()
+        quote_paragraph.paragraph_format.left_indent = Inches(0.5)
+        _add_inline_runs(quote_paragraph, child.get("children", []))
+
+def _emit_list(blocks, token):
+    attrs = token["attrs"]
+    style = 'List Number' if attrs.get("ordered") else 'List Bullet'
+    indent = Inches(0.25 * (attrs.get("depth", 0) + 1))
+    for item in token["children"]:
+        for child in item["children"]:
+            if child["type"] == "list":
+                _emit_list(blocks, child)
+            else:
+                paragraph = blocks.add_paragraph(style=style)
+                paragraph.paragraph_format.left_indent = indent
+                _add_inline_runs(paragraph, child.get("children", []))
+
+def _emit_table(blocks, token):
+    rows = []
+    for section in token["children"]:
+        if section["type"] == "table_head":
+            rows.append(section["children"])
+        else:
+            rows.extend(row["children"] for row in section["children"])
+    if not rows or not rows[0]:
+        logger.warning("Ignorando tentativa de criar uma tabela vazia ou malformada.")
+        return
+    num_cols = len(rows[0])
+    table = blocks.add_table(rows=len(rows), cols=num_cols)
+    table.style = 'Table Grid'
+    for r_idx, cells in enumerate(rows):
+        for c_idx, cell in enumerate(cells[:num_cols]):
+            _add_inline_runs(table.rows[r_idx].cells[c_idx].paragraphs[0], cell["children"])
+
+def _emit_thematic_break(blocks, token):
+    blocks.add_paragraph().add_run().add_break(docx.enum.text.WD_BREAK.LINE)
+
+
+_BLOCK_EMITTERS = {
+    "heading": _emit_heading,
+    "paragraph": _emit_paragraph,
+    "block_text": _emit_paragraph,
+    "block_code": _emit_code,
+    "block_quote": _emit_quote,
+    "list": _emit_list,
+    "table": _emit_table,
+    "thematic_break": _emit_thematic_break,
+}
+
+def process_markdown(text: str, doc: Document) -> None:
+    """Converte o texto Markdown em parágrafos, listas e tabelas no documento."""
+    blocks = _BlockBuffer(doc)
+    for token in _MARKDOWN_AST(text):
+        emitter = _BLOCK_EMITTERS.get(token["type"])
+        if emitter:
+            emitter(blocks, token)
+    blocks.flush()
+
+
 # def export_book(state: BookState) -> Dict[str, Any]:
 #     """Exporta o livro apenas para DOCX."""
 #     logger.info("Exportando livro para DOCX...")
@@ -342,35 +642,90 @@ def export_feedback(state: BookState) -> Dict[str, Any]:
 #     return updates
 
 
+# Fonte e cores da exportação sem template (instâncias criadas uma única vez)
+_ARIAL = 'Arial'
+_BLACK = RGBColor(0, 0, 0)
+_HEADING_BLUE = RGBColor(0, 51, 102)
+
+def _field_xml(field_code: str) -> str:
+    """Trecho XML de um campo do Word (begin/instrText/separate/end) dentro de um run."""
+    return (
+        '<w:fldChar w:fldCharType="begin"/>'
+        f'<w:instrText xml:space="preserve">{field_code}</w:instrText>'
+        '<w:fldChar w:fldCharType="separate"/>'
+        '<w:fldChar w:fldCharType="end"/>'
+    )
+
+# Runs com campos montados a partir de XML pré-composto (um parse_xml por uso)
+# Rodapé: "Página X de Y" em Arial 10
+_FOOTER_RUN_XML = (
+    f'<w:r {nsdecls("w")}>'
+    f'<w:rPr><w:rFonts w:ascii="{_ARIAL}" w:hAnsi="{_ARIAL}"/><w:sz w:val="20"/></w:rPr>'
+    '<w:t xml:space="preserve">Página </w:t>'
+    f'{_field_xml("PAGE")}'
+    '<w:t xml:space="preserve"> de </w:t>'
+    f'{_field_xml("NUMPAGES")}'
+    '</w:r>'
+)
+# Sumário automático com os níveis 1 a 3
+_TOC_FIELD_CODE = r'TOC \o "1-3" \h \z \u'
+_TOC_RUN_XML = f'<w:r {nsdecls("w")}>{_field_xml(_TOC_FIELD_CODE)}</w:r>'
+
+# Serialização do DOCX (lxml + zip) em segundo plano: o nó de exportação devolve o
+# caminho na hora e agent_book_generator só aguarda o arquivo antes do estado final.
+# Os salvamentos são indexados pelo caminho, então cada geração deve usar seu próprio
+# export_dir (o worker e /generate-book criam um diretório exclusivo por execução)
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="docx-save")
+_pending_saves: Dict[str, Future] = {}
+_pending_saves_lock = threading.Lock()
+
+def _save_document(doc: Document, title: str, export_dir: Optional[str] = None) -> str:
+    """Agenda o salvamento do documento em `export_dir` (ou no diretório temporário) e retorna o caminho."""
+    safe_title = title.replace(' ', '_').replace('/', '_').replace('\\', '_')
+    doc_path = os.path.join(export_dir or tempfile.gettempdir(), f"{safe_title}.docx")
+    future = _SAVE_EXECUTOR.submit(doc.save, doc_path)
+    with _pending_saves_lock:
+        _pending_saves[doc_path] = future
+    return doc_path
+
+def wait_for_export(doc_path: str) -> None:
+    """Aguarda o salvamento agendado para `doc_path` (propaga erros de escrita)."""
+    with _pending_saves_lock:
+        future = _pending_saves.pop(doc_path, None)
+    if future:
+        future.result()
+
+def discard_pending_export(doc_path: str) -> None:
+    """Descarta o salvamento agendado para `doc_path` que não será aguardado."""
+    with _pending_saves_lock:
+        future = _pending_saves.pop(doc_path, None)
+    if future:
+        future.cancel()
+
 def export_book(state: BookState) -> Dict[str, Any]:
     """Exporta o livro para DOCX com formatação completa e suporte total a Markdown."""
     logger.info("Exportando livro para DOCX com formatação completa...")
     doc = Document()
 
-    # Configuração de estilos
+    # Configuração de estilos: apenas os estilos usados no documento são alterados;
+    # listas, legendas e tabelas herdam a fonte do Normal
     styles = doc.styles
-    for style in styles:
-        if hasattr(style, 'font') and style.font:
-            style.font.name = 'Arial'
 
     title_style = styles['Title']
-    title_style.font.name = 'Arial'
+    title_style.font.name = _ARIAL
     title_style.font.size = Pt(24)
     title_style.font.bold = True
-    title_style.font.color.rgb = RGBColor(0, 0, 0)
+    title_style.font.color.rgb = _BLACK
 
-    heading_styles = {
-        1: styles['Heading 1'], 2: styles['Heading 2'], 3: styles['Heading 3'],
-        4: styles['Heading 4'], 5: styles['Heading 5'], 6: styles['Heading 6']
-    }
-    for level, style in heading_styles.items():
-        style.font.name = 'Arial'
+    for level in range(1, 7):
+        style = styles[f'Heading {level}']
+        style.font.name = _ARIAL
         style.font.size = Pt(16 - level * 2)  # Diminui o tamanho conforme o nível
         style.font.bold = True
-        style.font.color.rgb = RGBColor(0, 51, 102)
+        style.font.color.rgb = _HEADING_BLUE
 
     normal_style = styles['Normal']
-    normal_style.font.name = 'Arial'
+    normal_style.font.name = _ARIAL
     normal_style.font.size = Pt(12)
     normal_style.paragraph_format.line_spacing = 1.15
     normal_style.paragraph_format.space_after = Pt(10)
@@ -386,29 +741,7 @@ def export_book(state: BookState) -> Dict[str, Any]:
         footer = section.footer
         footer_paragraph = footer.paragraphs[0]
         footer_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-        footer_run = footer_paragraph.add_run()
-        footer_run.font.name = 'Arial'
-        footer_run.font.size = Pt(10)
-
-        def add_field(run, field_code):
-            field = OxmlElement('w:fldChar')
-            field.set(qn('w:fldCharType'), 'begin')
-            run._element.append(field)
-            instr = OxmlElement('w:instrText')
-            instr.set(qn('xml:space'), 'preserve')
-            instr.text = field_code
-            run._element.append(instr)
-            sep = OxmlElement('w:fldChar')
-            sep.set(qn('w:fldCharType'), 'separate')
-            run._element.append(sep)
-            end = OxmlElement('w:fldChar')
-            end.set(qn('w:fldCharType'), 'end')
-            run._element.append(end)
-
-        footer_run.add_text('Página ')
-        add_field(footer_run, 'PAGE')
-        footer_run.add_text(' de ')
-        add_field(footer_run, 'NUMPAGES')
+        footer_paragraph._p.append(parse_xml(_FOOTER_RUN_XML))
 
     # Adicionar título
     title_paragraph = doc.add_paragraph(state["title"], style='Title')
@@ -427,154 +760,12 @@ def export_book(state: BookState) -> Dict[str, Any]:
     # Adicionar sumário
     doc.add_heading("Sumário", level=1)
     toc_paragraph = doc.add_paragraph()
-    toc_run = toc_paragraph.add_run()
-    toc_field = OxmlElement('w:fldChar')
-    toc_field.set(qn('w:fldCharType'), 'begin')
-    toc_run._element.append(toc_field)
-    toc_instr = OxmlElement('w:instrText')
-    toc_instr.set(qn('xml:space'), 'preserve')
-    toc_instr.text = 'TOC \\o "1-3" \\h \\z \\u'  # Níveis 1 a 3
-    toc_run._element.append(toc_instr)
-    toc_sep = OxmlElement('w:fldChar')
-    toc_sep.set(qn('w:fldCharType'), 'separate')
-    toc_run._element.append(toc_sep)
-    toc_end = OxmlElement('w:fldChar')
-    toc_end.set(qn('w:fldCharType'), 'end')
-    toc_run._element.append(toc_end)
+    toc_paragraph._p.append(parse_xml(_TOC_RUN_XML))
     doc.add_paragraph("Insira o sumário automático manualamente.", style='Caption')
     doc.add_page_break()
 
-    # Parser Markdown completo
-    def process_markdown(text, doc):
-        lines = text.split('\n')
-        in_code_block = False
-        code_lines = []
-        in_table = False
-        table_rows = []
-
-        for i, line in enumerate(lines):
-            line = line.rstrip()
-            if not line and not in_code_block and not in_table:
-                continue
-
-            # Blocos de código
-            if line.strip() == '```':
-                if not in_code_block:
-                    in_code_block = True
-                    code_lines = []
-                else:
-                    in_code_block = False
-                    code_paragraph = doc.add_paragraph()
-                    code_paragraph.paragraph_format.left_indent = Inches(0.5)
-                    code_paragraph.paragraph_format.right_indent = Inches(0.5)
-                    run = code_paragraph.add_run('\n'.join(code_lines))
-                    run.font.name = 'Courier New'
-                    run.font.size = Pt(10)
-                    run.font.color.rgb = RGBColor(50, 50, 50)
-                continue
-            if in_code_block:
-                code_lines.append(line)
-                continue
-
-            # Títulos
-            if line.startswith('#'):
-                level = min(line.count('#', 0, 6), 6)
-                title_text = line.lstrip('#').strip()
-                doc.add_heading(title_text, level=min(level, 6))
-                continue
-
-            # Linha horizontal
-            if re.match(r'^\s*[-*_]{3,}\s*$', line):
-                doc.add_paragraph().add_run().add_break(docx.enum.text.WD_BREAK.LINE)
-                continue
-
-            # Citações
-            if line.startswith('>'):
-                quote_paragraph = doc.add_paragraph()
-                quote_paragraph.paragraph_format.left_indent = Inches(0.5)
-                apply_inline_formatting(line.lstrip('>').strip(), quote_paragraph)
-                continue
-
-            # Listas ordenadas e não ordenadas
-            if re.match(r'^\s*(\d+\.|-|\*|\+)\s+', line):
-                indent_level = len(re.match(r'^\s*', line).group()) // 2
-                list_item = re.sub(r'^\s*(\d+\.|-|\*|\+)\s+', '', line).strip()
-                style = 'List Number' if re.match(r'^\s*\d+\.\s+', line) else 'List Bullet'
-                paragraph = doc.add_paragraph(style=style)
-                paragraph.paragraph_format.left_indent = Inches(0.25 * (indent_level + 1))
-                apply_inline_formatting(list_item, paragraph)
-                continue
-
-            # Tabelas
-            if line.startswith('|') and '|' in line[1:]:
-                if not in_table:
-                    in_table = True
-                    table_rows = []
-                row = [cell.strip() for cell in line.split('|')[1:-1]]
-                if row and not re.match(r'^\s*-+\s*$', row[0]):  # Ignora linha de separação
-                    table_rows.append(row)
-                elif table_rows:  # Fim da tabela após separador
-                    in_table = False
-                    # ADICIONE ESTA VERIFICAÇÃO
-                    if len(table_rows) > 0 and len(table_rows[0]) > 0:
-                        table = doc.add_table(rows=len(table_rows), cols=len(table_rows[0]))
-                        table.style = 'Table Grid'
-                        for r_idx, row_data in enumerate(table_rows):
-                            # Garante que todas as linhas tenham o mesmo número de colunas
-                            if len(row_data) == len(table_rows[0]):
-                                for c_idx, cell_text in enumerate(row_data):
-                                    try:
-                                        cell = table.rows[r_idx].cells[c_idx]
-                                        apply_inline_formatting(cell_text, cell.paragraphs[0])
-                                    except IndexError:
-                                        logger.warning(f"Ignorando célula fora do alcance na tabela. Linha {r_idx}, Coluna {c_idx}")
-                    else:
-                        logger.warning("Ignorando tentativa de criar uma tabela vazia ou malformada.")
-                    table_rows = [] # Limpa para a próxima tabela
-                continue
-
-            # Parágrafo simples
-            paragraph = doc.add_paragraph()
-            apply_inline_formatting(line, paragraph)
-
-    # Função para aplicar formatação inline
-    def apply_inline_formatting(text, paragraph):
-        # Regex para capturar negrito, itálico, tachado e links
-        pattern = r'(\*\*\*.*?\*\*\*|\*\*.*?\*\*|\*.*?\*|~~.*?~~|$$ .*? $$$$ .*? $$|_.*?_)'
-        parts = re.split(pattern, text)
-        
-        for part in parts:
-            if not part:
-                continue
-            run = paragraph.add_run()
-            if part.startswith('***') and part.endswith('***'):
-                run.text = part[3:-3]
-                run.bold = True
-                run.italic = True
-            elif part.startswith('**') and part.endswith('**'):
-                run.text = part[2:-2]
-                run.bold = True
-            elif part.startswith('*') and part.endswith('*'):
-                run.text = part[1:-1]
-                run.italic = True
-            elif part.startswith('_') and part.endswith('_'):
-                run.text = part[1:-1]
-                run.italic = True
-            elif part.startswith('~~') and part.endswith('~~'):
-                run.text = part[2:-2]
-                run.font.strike = True
-            elif part.startswith('[') and ']' in part and '(' in part and part.endswith(')'):
-                link_text = part[1:part.index(']')]
-                link_url = part[part.index('(')+1:-1]
-                run.text = link_text
-                run.font.underline = True
-                run.font.color.rgb = RGBColor(0, 0, 255)
-                # python-docx não suporta hiperlinks diretamente; URL é apenas visual
-            else:
-                run.text = part
-
     # Adicionar capítulos
-    for chapter_num, chapter_data in sorted(state["chapters"].items()):
+    for chapter_num, chapter_data in state["chapters"].items():
         doc.add_heading(f"Capítulo {chapter_num}: {chapter_data['title']}", level=1)
         process_markdown(chapter_data["content"], doc)
         if chapter_num < len(state["chapters"]):
@@ -587,10 +778,7 @@ def export_book(state: BookState) -> Dict[str, Any]:
 
     # Salvar em arquivo temporário (não na raiz do projeto)
     # O arquivo será enviado para o GCS e depois apagado automaticamente
-    temp_dir = tempfile.gettempdir()
-    safe_title = state['title'].replace(' ', '_').replace('/', '_').replace('\\', '_')
-    doc_path = os.path.join(temp_dir, f"{safe_title}.docx")
-    doc.save(doc_path)
+    doc_path = _save_document(doc, state['title'], state.get('export_dir'))
 
     updates = {
         "export_path": doc_path,
@@ -604,6 +792,50 @@ def export_book(state: BookState) -> Dict[str, Any]:
 # Flag para usar template DOCX (True = usa template, False = cria do zero)
 USE_TEMPLATE = True
 
+def _inline_bold_italic(paragraph, match):
+    run = paragraph.add_run(match.group("bi_text"))
+    run.bold = True
+    run.italic = True
+
+def _inline_bold(paragraph, match):
+    paragraph.add_run(match.group("b_text")).bold = True
+
+def _inline_italic(paragraph, match):
+    paragraph.add_run(match.group("i_text")).italic = True
+
+def _inline_underscore_italic(paragraph, match):
+    paragraph.add_run(match.group("u_text")).italic = True
+
+def _inline_strike(paragraph, match):
+    paragraph.add_run(match.group("s_text")).font.strike = True
+
+def _inline_link(paragraph, match):
+    # python-docx não suporta hiperlinks diretamente; URL é apenas visual
+    run = paragraph.add_run(match.group("lnk_text"))
+    run.font.underline = True
+    run.font.color.rgb = RGBColor(0, 0, 255)
+
+_INLINE_TEMPLATE_APPLY = {
+    "bi": _inline_bold_italic,
+    "b": _inline_bold,
+    "i": _inline_italic,
+    "u": _inline_underscore_italic,
+    "s": _inline_strike,
+    "lnk": _inline_link,
+}
+
+def apply_inline_formatting_template(text: str, paragraph):
+    """Aplica formatação inline (negrito, itálico, etc.) ao parágrafo."""
+    pos = 0
+    for match in _MD_INLINE_TEMPLATE_RE.finditer(text):
+        if match.start() > pos:
+            paragraph.add_run(text[pos:match.start()])
+        _INLINE_TEMPLATE_APPLY[match.lastgroup](paragraph, match)
+        pos = match.end()
+    if pos < len(text):
+        paragraph.add_run(text[pos:])
+
+
 def export_book_from_template(state: BookState) -> Dict[str, Any]:
     """Exporta o livro usando template DOCX pré-configurado."""
     logger.info("Exportando livro usando template DOCX...")
@@ -678,33 +910,17 @@ def export_book_from_template(state: BookState) -> Dict[str, Any]:
             style_name = 'Normal'
             content = line
             
-            if line.startswith('######'):
-                style_name = 'Heading 6'
-                content = line.lstrip('#').strip()
-            elif line.startswith('#####'):
-                style_name = 'Heading 5'
-                content = line.lstrip('#').strip()
-            elif line.startswith('####'):
-                style_name = 'Heading 4'
-                content = line.lstrip('#').strip()
-            elif line.startswith('###'):
-                style_name = 'Heading 3'
-                content = line.lstrip('#').strip()
-            elif line.startswith('##'):
-                style_name = 'Heading 2'
-                content = line.lstrip('#').strip()
-            elif line.startswith('#'):
-                style_name = 'Heading 1'
-                content = line.lstrip('#').strip()
+            if line.startswith('#'):
+                # Nível = quantidade de '#' iniciais (um único lstrip), limitado a 6
+                stripped = line.lstrip('#')
+                style_name = _HEADING_STYLE_NAMES[min(len(line) - len(stripped), 6)]
+                content = stripped.strip()
             elif line.startswith('>'):
                 style_name = 'Quote'
                 content = line.lstrip('>').strip()
-            elif re.match(r'^\s*[-*+]\s+', line):
-                style_name = 'List Paragraph'
-                content = re.sub(r'^\s*[-*+]\s+', '', line)
-            elif re.match(r'^\s*\d+\.\s+', line):
+            elif (list_match := _MD_BULLET_RE.match(line) or _MD_ORDERED_RE.match(line)):
                 style_name = 'List Paragraph'
-                content = re.sub(r'^\s*\d+\.\s+', '', line)
+                content = line[list_match.end():]
             
             # Inserir novo parágrafo após o índice atual
             current_para = doc.paragraphs[current_index]._element
@@ -725,34 +941,6 @@ def export_book_from_template(state: BookState) -> Dict[str, Any]:
         
         return current_index
     
-    def apply_inline_formatting_template(text: str, paragraph):
-        """Aplica formatação inline (negrito, itálico, etc.) ao parágrafo."""
-        pattern = r'(\*\*\*.*?\*\*\*|\*\*.*?\*\*|\*.*?\*|~~.*?~~|_.*?_)'
-        parts = re.split(pattern, text)
-        
-        for part in parts:
-            if not part:
-                continue
-            run = paragraph.add_run()
-            if part.startswith('***') and part.endswith('***'):
-                run.text = part[3:-3]
-                run.bold = True
-                run.italic = True
-            elif part.startswith('**') and part.endswith('**'):
-                run.text = part[2:-2]
-                run.bold = True
-            elif part.startswith('*') and part.endswith('*'):
-                run.text = part[1:-1]
-                run.italic = True
-            elif part.startswith('_') and part.endswith('_'):
-                run.text = part[1:-1]
-                run.italic = True
-            elif part.startswith('~~') and part.endswith('~~'):
-                run.text = part[2:-2]
-                run.font.strike = True
-            else:
-                run.text = part
-    
     # 4. Processar placeholder {{INTRODUCAO}} - Título, Tema e Público-Alvo
     for i, para in enumerate(doc.paragraphs):
         if "{{INTRODUCAO}}" in para.text:
@@ -821,7 +1009,7 @@ def export_book_from_template(state: BookState) -> Dict[str, Any]:
     # Inserir conteúdo dos capítulos
     current_idx = placeholder_index
     
-    for chapter_num, chapter_data in sorted(state["chapters"].items()):
+    for chapter_num, chapter_data in state["chapters"].items():
         # Adicionar título do capítulo
         current_para = doc.paragraphs[current_idx]._element
         new_para_elem = OxmlElement('w:p')
@@ -924,10 +1112,7 @@ def export_book_from_template(state: BookState) -> Dict[str, Any]:
         logger.warning(f"Não foi possível marcar campos para atualização: {e}")
     
     # 9. Salvar arquivo temporário
-    temp_dir = tempfile.gettempdir()
-    safe_title = state['title'].replace(' ', '_').replace('/', '_').replace('\\', '_')
-    doc_path = os.path.join(temp_dir, f"{safe_title}.docx")
-    doc.save(doc_path)
+    doc_path = _save_document(doc, state['title'], state.get('export_dir'))
     
     updates = {
         "export_path": doc_path,
@@ -939,9 +1124,8 @@ def export_book_from_template(state: BookState) -> Dict[str, Any]:
 def router(state: BookState) -> str:
     """Decide o próximo estado."""
     status_map = {
-        "start": "get_book_info",
-        "book_info_collected": "create_outline",
-        "outline_created": "write_chapter",
+        "start": "plan_book",
+        "planned": "write_all_chapters" if PARALLEL_CHAPTERS else "write_chapter",
         "chapter_written": "write_chapter",
         "all_chapters_written": "review_and_edit",
         "reviewed": "export_feedback",
@@ -952,15 +1136,17 @@ def router(state: BookState) -> str:
     logger.debug(f"Transição de estado: {state['status']} -> {next_state}")
     return next_state
 
-def create_book_agent(model, st_session=None):
-    """Cria o agente de geração de livros."""
+def create_book_agent(models: Dict[str, Any], st_session=None):
+    """Cria o agente de geração de livros (modelos vindos de get_models())."""
     logger.info("Criando agente de geração de livros...")
     workflow = StateGraph(BookState)
+    fast_model = models["fast"]
+    quality_model = models["quality"]
     
-    workflow.add_node("get_book_info", lambda state: get_book_info(state, model))
-    workflow.add_node("create_outline", lambda state: create_outline(state, model))
-    workflow.add_node("write_chapter", lambda state: write_chapter(state, model, st_session))
-    workflow.add_node("review_and_edit", lambda state: review_and_edit(state, model))
+    workflow.add_node("plan_book", lambda state: plan_book(state, fast_model))
+    workflow.add_node("write_chapter", lambda state: write_chapter(state, quality_model, st_session))
+    workflow.add_node("write_all_chapters", lambda state: write_all_chapters(state, quality_model))
+    workflow.add_node("review_and_edit", lambda state: review_and_edit(state, quality_model))
     workflow.add_node("export_feedback", export_feedback)
     
     # Usar template ou geração do zero baseado na flag USE_TEMPLATE
@@ -971,35 +1157,111 @@ def create_book_agent(model, st_session=None):
         logger.info("Usando geração do zero (sem template)")
         workflow.add_node("export_book", export_book)
     
-    workflow.set_entry_point("get_book_info")
+    workflow.set_entry_point("plan_book")
     
-    workflow.add_conditional_edges("get_book_info", router)
-    workflow.add_conditional_edges("create_outline", router)
+    workflow.add_conditional_edges("plan_book", router)
     workflow.add_conditional_edges("write_chapter", router)
+    workflow.add_conditional_edges("write_all_chapters", router)
     workflow.add_conditional_edges("review_and_edit", router)
     workflow.add_conditional_edges("export_feedback", router)
     workflow.add_conditional_edges("export_book", router)
     
-    memory = MemorySaver()
-    return workflow.compile(checkpointer=memory)
+    return workflow.compile(checkpointer=get_checkpointer())
+
+def _model_name(model) -> str:
+    """Nome do modelo (Gemini API usa `model_name`, Vertex AI usa `_model_name`)."""
+    return getattr(model, "model_name", None) or getattr(model, "_model_name", None) or os.getenv("GEMINI_MODEL", "")
 
 def generate_with_retry(model, prompt, retries=3, delay=5):
+    # Respostas idênticas para o mesmo (modelo, prompt) vêm do cache em disco, se habilitado
+    cache = get_llm_cache()
+    cache_key = None
+    if cache:
+        cache_key = LLMCache.make_key(_model_name(model), prompt)
+        cached_text = cache.get(cache_key)
+        if cached_text is not None:
+            logger.info("Resposta obtida do cache de LLM")
+            return TextResponse(cached_text)
+
+    # O ritmo das chamadas é controlado pelo token bucket (GEMINI_RPM_LIMIT), que só
+    # bloqueia quando a cota por minuto se esgota
+    limiter = get_rate_limiter()
     for i in range(retries):
+        if limiter:
+            limiter.acquire()
         try:
             response = model.generate_content(prompt)
+            if cache_key:
+                cache.set(cache_key, response.text)
             return response
         except Exception as e:
             logger.warning(f"Erro na chamada da API (tentativa {i+1}/{retries}): {e}")
-            time.sleep(delay)
+            if i < retries - 1:
+                # Backoff exponencial com jitter
+                time.sleep(delay * (2 ** i) + random.random())
     logger.error("Falha ao gerar conteúdo após múltiplas tentativas.")
     return None # Ou lançar uma exceção
 
-def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "", custom_theme: str = "", custom_num_chapters: int = 5, author_name: str = "SENAI"):
+def _chunk_text(chunk) -> str:
+    """Texto de um trecho do stream (trechos só com metadados não têm texto)."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def generate_stream_with_retry(model, prompt, on_chunk, retries=3, delay=5):
+    """
+    Como generate_with_retry, mas repassa cada trecho do texto a `on_chunk` assim
+    que chega do modelo. Só a abertura do stream é repetida: se a falha ocorrer
+    depois de algum trecho já entregue, a geração é abortada para não duplicar texto.
+    """
+    cache = get_llm_cache()
+    cache_key = None
+    if cache:
+        cache_key = LLMCache.make_key(_model_name(model), prompt)
+        cached_text = cache.get(cache_key)
+        if cached_text is not None:
+            logger.info("Resposta obtida do cache de LLM")
+            on_chunk(cached_text)
+            return TextResponse(cached_text)
+
+    limiter = get_rate_limiter()
+    for i in range(retries):
+        if limiter:
+            limiter.acquire()
+        chunks = []
+        try:
+            for chunk in model.generate_content(prompt, stream=True):
+                text = _chunk_text(chunk)
+                if text:
+                    chunks.append(text)
+                    on_chunk(text)
+            if not chunks:
+                raise ValueError("Resposta vazia do modelo")
+            response_text = "".join(chunks)
+            if cache_key:
+                cache.set(cache_key, response_text)
+            return TextResponse(response_text)
+        except Exception as e:
+            logger.warning(f"Erro na chamada da API (tentativa {i+1}/{retries}): {e}")
+            if chunks:
+                break
+            if i < retries - 1:
+                # Backoff exponencial com jitter
+                time.sleep(delay * (2 ** i) + random.random())
+    logger.error("Falha ao gerar conteúdo após múltiplas tentativas.")
+    return None
+
+def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "", custom_theme: str = "", custom_num_chapters: int = 5, author_name: str = "SENAI", export_dir: Optional[str] = None):
     """Executa o agente de geração de livros e emite atualizações de progresso."""
     logger.info("Iniciando processo de geração de livro...")
+    # Cada geração usa sua própria thread de checkpoints, removida ao final
+    thread_id = uuid.uuid4().hex
+    book_agent = None
+    # Caminho do DOCX agendado pelo nó de exportação (descartado no finally se não for aguardado)
+    export_path = None
     try:
-        model = get_model()
-        book_agent = create_book_agent(model)
+        book_agent = create_book_agent(get_models())
 
         initial_state = BookState(status="start")
         # ... (código de preenchimento do initial_state) ...
@@ -1008,50 +1270,93 @@ def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "",
         if custom_audience: initial_state["target_audience"] = custom_audience
         initial_state["num_chapters"] = custom_num_chapters
         initial_state["author_name"] = author_name
+        if export_dir: initial_state["export_dir"] = export_dir
 
-        config = {"configurable": {"thread_id": "1"}, "recursion_limit": 1000}
+        config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 1000}
 
         # Define o número total de etapas para a barra de progresso
         total_steps = 2 + custom_num_chapters + 2  # Título, Sumário, N Capítulos, Revisão, Exportação
+        # write_chapter devolve apenas o capítulo escrito; o total vem do sumário
+        total_chapters = custom_num_chapters
+
+        # Percentuais da barra de progresso pré-calculados por etapa (e por meia etapa,
+        # usada nos avisos "Escrevendo..."); o laço apenas indexa as tabelas
+        def progress_tables(last_step: int):
+            steps = range(last_step + 1)
+            return ([int((step / total_steps) * 100) for step in steps],
+                    [int(((step + 0.5) / total_steps) * 100) for step in steps])
+
+        step_values, half_step_values = progress_tables(total_steps)
+        review_step, export_step = total_steps - 1, total_steps
+        stage_progress = {
+            "reviewed": {"type": "progress", "text": f"Etapa {review_step}/{total_steps}: Revisando o conteúdo...",
+                         "value": step_values[review_step]},
+            "exported": {"type": "progress", "text": f"Etapa {export_step}/{total_steps}: Gerando documento final...",
+                         "value": step_values[export_step]},
+        }
+
+        for mode, output in book_agent.stream(initial_state, config=config, stream_mode=["updates", "custom"]):
+            # Trechos do capítulo em escrita (modo sequencial) chegam pelo stream "custom"
+            if mode == "custom":
+                if output.get("text"):
+                    yield output["text"]
+                continue
 
-        for output in book_agent.stream(initial_state, config=config):
             node_name = list(output.keys())[0] if output else "unknown"
             node_output = output.get(node_name, {})
             stage = node_output.get("status", "desconhecido")
+            if node_output.get("export_path"):
+                export_path = node_output["export_path"]
 
             # --- LÓGICA DA BARRA DE PROGRESSO MELHORADA ---
             progress_update = None
             current_step = 0
 
-            if stage == "book_info_collected":
-                current_step = 1
-                progress_update = {
+            if stage == "planned":
+                # Título e sumário chegam juntos, de uma única chamada ao modelo
+                yield {
                     "type": "progress",
-                    "text": f"Etapa {current_step}/{total_steps}: Gerando título...",
-                    "value": int((current_step / total_steps) * 100)
+                    "text": f"Etapa 1/{total_steps}: Gerando título...",
+                    "value": step_values[1]
                 }
-            elif stage == "outline_created":
+                yield f"# {node_output.get('title', 'Título não gerado')}\n"
+
                 current_step = 2
+                total_chapters = len(node_output.get("chapters", {})) or custom_num_chapters
+                if total_chapters > custom_num_chapters:
+                    # Sumário com mais capítulos que o pedido: amplia as tabelas uma vez
+                    step_values, half_step_values = progress_tables(2 + total_chapters)
                 progress_update = {
                     "type": "progress",
                     "text": f"Etapa {current_step}/{total_steps}: Sumário criado!",
-                    "value": int((current_step / total_steps) * 100)
+                    "value": step_values[current_step]
                 }
                 # Emitir progresso do sumário
                 yield progress_update
                 
-                # Anunciar que vai começar a escrever o primeiro capítulo
+                # Anunciar que vai começar a escrever os capítulos
+                if PARALLEL_CHAPTERS:
+                    writing_text = f"Etapa 3/{total_steps}: Escrevendo {custom_num_chapters} capítulos em paralelo..."
+                else:
+                    writing_text = f"Etapa 3/{total_steps}: Escrevendo capítulo 1/{custom_num_chapters}..."
                 progress_update = {
                     "type": "progress",
-                    "text": f"Etapa 3/{total_steps}: Escrevendo capítulo 1/{custom_num_chapters}...",
-                    "value": int((2.5 / total_steps) * 100)
+                    "text": writing_text,
+                    "value": half_step_values[2]
+                }
+            elif node_name == "write_all_chapters" and "chapters" in node_output:
+                total_chapters = len(node_output["chapters"])
+                current_step = 2 + total_chapters
+                progress_update = {
+                    "type": "progress",
+                    "text": f"Etapa {current_step}/{total_steps}: {total_chapters} capítulos concluídos!",
+                    "value": step_values[current_step]
                 }
             elif node_name == "write_chapter" and "chapters" in node_output:
                 # current_chapter indica o PRÓXIMO capítulo a ser escrito
                 # Então o capítulo que acabou de ser concluído é current_chapter - 1
-                written_chapter_num = node_output.get("current_chapter", 1) - 1
                 next_chapter_num = node_output.get("current_chapter", 1)
-                total_chapters = len(node_output["chapters"])
+                written_chapter_num = next_chapter_num - 1
                 
                 if written_chapter_num > 0:
                     current_step = 2 + written_chapter_num
@@ -1059,7 +1364,7 @@ def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "",
                     progress_update = {
                         "type": "progress",
                         "text": f"Etapa {current_step}/{total_steps}: Capítulo {written_chapter_num}/{total_chapters} concluído!",
-                        "value": int((current_step / total_steps) * 100)
+                        "value": step_values[current_step]
                     }
                     # Emitir progresso de conclusão
                     yield progress_update
@@ -1069,24 +1374,12 @@ def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "",
                         progress_update = {
                             "type": "progress",
                             "text": f"Etapa {current_step + 1}/{total_steps}: Escrevendo capítulo {next_chapter_num}/{total_chapters}...",
-                            "value": int(((current_step + 0.5) / total_steps) * 100)
+                            "value": half_step_values[current_step]
                         }
                     else:
                         progress_update = None
-            elif stage == "reviewed":
-                current_step = 2 + custom_num_chapters + 1
-                progress_update = {
-                    "type": "progress",
-                    "text": f"Etapa {current_step}/{total_steps}: Revisando o conteúdo...",
-                    "value": int((current_step / total_steps) * 100)
-                }
-            elif stage == "exported":
-                current_step = 2 + custom_num_chapters + 2
-                progress_update = {
-                    "type": "progress",
-                    "text": f"Etapa {current_step}/{total_steps}: Gerando documento final...",
-                    "value": int((current_step / total_steps) * 100)
-                }
+            elif stage in stage_progress:
+                progress_update = stage_progress[stage]
             
             if progress_update:
                 yield progress_update
@@ -1095,32 +1388,22 @@ def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "",
             # O restante do código de 'yield' para o conteúdo de texto continua o mesmo
             # yield f"**Etapa Concluída:** {stage}"
 
-            if stage == "book_info_collected":
-                title = node_output.get('title', 'Título não gerado')
-                yield f"# {title}\n"
-
-            elif stage == "outline_created":
+            if stage == "planned":
                 outline = node_output.get('outline', [])
                 if outline:
-                    summary_text = "## Sumário\n---\n"
+                    summary_parts = ["## Sumário\n---\n"]
                     for item in outline:
-                        num = item.get('chapter_number', 'N/A')
-                        title = item.get('chapter_title', 'Sem título')
-                        desc = item.get('chapter_description', 'Sem descrição')
-                        summary_text += f"### Capítulo {num}: {title}\n"
-                        summary_text += f"*{desc}*\n\n"
-                    yield summary_text
-
-            # Modificação para exibir o último capítulo
-            elif stage == "chapter_written" or (node_name == "write_chapter" and stage == "all_chapters_written"):
-                # O 'current_chapter' no estado já foi incrementado, então subtraímos 1 para pegar o que acabou de ser escrito.
-                current_chap_num = node_output.get('current_chapter', 0) - 1
-                if current_chap_num > 0:
-                    chapters_data = node_output.get("chapters", {})
-                    chapter_info = chapters_data.get(current_chap_num)
-
-                    # Garante que a informação do capítulo e o conteúdo existam
-                    if chapter_info and chapter_info.get("content"):
+                        num, title, desc = (item.get('chapter_number', 'N/A'),
+                                            item.get('chapter_title', 'Sem título'),
+                                            item.get('chapter_description', 'Sem descrição'))
+                        summary_parts.append(f"### Capítulo {num}: {title}\n*{desc}*\n\n")
+                    yield "".join(summary_parts)
+
+            # Capítulos escritos em paralelo chegam todos juntos, em ordem
+            # (no modo sequencial já foram entregues em trechos pelo stream "custom")
+            if node_name == "write_all_chapters":
+                for chapter_info in node_output.get("chapters", {}).values():
+                    if chapter_info.get("content"):
                         yield chapter_info["content"]
 
         checkpoint = book_agent.checkpointer.get(config)
@@ -1129,17 +1412,41 @@ def agent_book_generator(area_tecnologica: str = "", custom_audience: str = "",
         # Extrair o estado correto do checkpoint
         # O checkpointer retorna um objeto com 'channel_values' contendo o estado
         if checkpoint and hasattr(checkpoint, 'channel_values'):
-            final_state = dict(checkpoint.channel_values)
+            channel_values = checkpoint.channel_values
         elif isinstance(checkpoint, dict):
-            final_state = checkpoint.get('channel_values', checkpoint)
+            channel_values = checkpoint.get('channel_values', checkpoint)
         else:
-            final_state = {}
+            channel_values = {}
+
+        # Apenas os campos usados pelos consumidores (app e worker): não copia o estado
+        # inteiro nem envia o texto de todos os capítulos no payload do evento "done"
+        final_state = {
+            "status": channel_values.get("status"),
+            "title": channel_values.get("title"),
+            "export_path": channel_values.get("export_path"),
+            "chapters_count": len(channel_values.get("chapters") or {}),
+        }
         
-        logger.info(f"DEBUG - final_state keys: {final_state.keys() if isinstance(final_state, dict) else 'not a dict'}")
-        logger.info(f"DEBUG - export_path in final_state: {final_state.get('export_path', 'NOT FOUND')}")
+        logger.info(f"DEBUG - final_state: {final_state}")
+
+        # O DOCX é salvo em segundo plano; garante que o arquivo existe antes de entregá-lo
+        if final_state.get("export_path"):
+            wait_for_export(final_state["export_path"])
 
         yield {"final_state": final_state}
 
     except Exception as e:
         logger.error(f"Erro durante a geração do livro: {e}")
-        yield {"final_state": {"status": "error", "message": str(e)}}
\ No newline at end of file
+        yield {"final_state": {"status": "error", "message": str(e)}}
+    finally:
+        # Erro ou gerador interrompido depois da exportação: o salvamento pendente não
+        # fica preso em _pending_saves (no caminho normal wait_for_export já o removeu)
+        if export_path:
+            discard_pending_export(export_path)
+        # A thread não é relida depois da geração: apaga os checkpoints (também em
+        # execuções com erro) para o arquivo SQLite não acumular o texto de todos os livros
+        if book_agent is not None:
+            try:
+                book_agent.checkpointer.delete_thread(thread_id)
+            except Exception as e:
+                logger.warning(f"Não foi possível remover os checkpoints da thread {thread_id}: {e}")
\ No newline at end of file
@@ -1,23 +1,37 @@
-import sys
 import os
-import json
 import logging
-import uuid as uuid_lib
+import re
+import time
+import shutil
+import tempfile
+import itertools
+from pathlib import Path
+from urllib.parse import quote
+from typing import Any, Dict, Optional, Type
 import requests
-from fastapi import FastAPI, HTTPException, Depends
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse, RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse, FileResponse, RedirectResponse
+from fastapi.sse import EventSourceResponse, ServerSentEvent
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, func, insert
+from sqlalchemy.orm import defer
+from sqlalchemy.ext.asyncio import AsyncSession
 from api.models import (
-    BookRequest, ProgressUpdate, ApostilaResponse, ApostilasListResponse,
+    BookRequest, ApostilasListResponse, apostila_list_adapter,
     CreateJobRequest, CreateJobResponse, JobStatusResponse,
-    RefineThemeRequest, RefineThemeResponse
+    ActiveJobsResponse, job_summary_list_adapter,
+    RefineThemeRequest, RefineThemeResponse, ProgressUpdate
 )
-from api.database import get_db, init_db
-from api.db_models import Apostila, GenerationJob
-from api.storage import upload_to_gcs, generate_signed_url, download_from_gcs, blob_exists, upload_bytes_to_gcs
-from api.auth_middleware import get_current_user, AuthenticatedUser
-from api.worker import start_generation_job
+from api.database import SessionLocal, get_async_db, get_read_db, init_db
+from api.db_models import Apostila, GenerationJob, JobContentChunk
+from api.storage import upload_to_gcs, generate_signed_url, download_from_gcs, iter_gcs_blob, blob_exists, upload_bytes_to_gcs
+from api.auth_middleware import get_current_user, AuthenticatedUser, warm_up_jwks
+from api.worker import start_generation_job, shutdown_worker, content_blob_name
 
 from api.agent import agent_book_generator, get_model, generate_with_retry
 
@@ -29,6 +43,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Diretório base já resolvido uma única vez (proteção contra Path Traversal sem
+# repetir o realpath da base a cada requisição)
+_REAL_BASE_DIR = Path(os.getcwd()).resolve()
+
+# Atrás de um Nginx, prefixo da location interna que serve os arquivos gerados
+# (ex: "/internal-downloads/"); o Nginx envia o arquivo via sendfile e o Python
+# apenas responde com o cabeçalho X-Accel-Redirect. Vazio = FileResponse.
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.getenv("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Nome de arquivo servido por /download: um único componente (sem separadores nem
+# caracteres de controle, sem começar com ".") terminado em .docx; aceita acentos dos títulos
+_SAFE_FILENAME_RE = re.compile(r"[^./\\\x00-\x1f\x7f][^/\\\x00-\x1f\x7f]{0,199}\.docx")
+
+# Validação dos IDs (UUID canônico) sem criar o objeto nem capturar exceção
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+
+
+def json_body(model: Type[BaseModel]):
+    """
+    Dependency que valida o corpo JSON com model_validate_json: parse e validação numa
+    única passada do pydantic-core, sem o dict intermediário do json.loads.
+    Erros seguem o formato 422 do FastAPI (loc iniciando em "body").
+    """
+    async def dependency(request: Request):
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+            )
+    return dependency
+
+
+def json_body_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """openapi_extra documentando o corpo lido por json_body."""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
 app = FastAPI(
     title="Gerador de Apostila API",
     description="API para geração de apostilas técnicas usando Agentes AI",
@@ -36,14 +89,53 @@ app = FastAPI(
 )
 
 # Configure CORS
+# Origens permitidas: lista separada por vírgulas (CORS_ORIGINS) e/ou expressão
+# regular (CORS_ORIGIN_REGEX, compilada uma vez pelo middleware). Padrão: qualquer origem.
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+CORS_ORIGIN_REGEX = os.getenv("CORS_ORIGIN_REGEX") or None
+# Credenciais (cookies) só com origens explícitas: com "*" o Starlette ecoaria qualquer
+# Origin com credenciais liberadas. O token Bearer no Authorization não depende disso.
+CORS_ALLOW_CREDENTIALS = "*" not in CORS_ORIGINS
+# Cabeçalhos aceitos no preflight (Accept, Accept-Language e Content-Language já são
+# sempre permitidos); clientes que enviam outros cabeçalhos devem listá-los aqui
+CORS_ALLOW_HEADERS = [header.strip() for header in os.getenv("CORS_ALLOW_HEADERS", "Authorization,Content-Type").split(",") if header.strip()]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with specific origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_origin_regex=CORS_ORIGIN_REGEX,
+    allow_credentials=CORS_ALLOW_CREDENTIALS,
+    # Apenas o que a API usa: o preflight não precisa ecoar métodos/cabeçalhos arbitrários
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=CORS_ALLOW_HEADERS,
 )
 
+# Rotas que entregam DOCX/PDF: os formatos já são compactados (ZIP/deflate), então o
+# gzip só gastaria CPU, removeria o Content-Length e seguraria o streaming do preview
+_UNCOMPRESSED_PATH_RE = re.compile(r"^/download/|^/apostilas/[^/]+/[^/]+/(?:preview|pdf)$")
+
+
+class JSONGZipMiddleware:
+    """
+    GZipMiddleware aplicado apenas fora das rotas de arquivo (_UNCOMPRESSED_PATH_RE).
+    O tipo da resposta só é conhecido depois do handler, então a seleção é pela rota.
+    """
+
+    def __init__(self, app, **gzip_options):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, **gzip_options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not _UNCOMPRESSED_PATH_RE.search(scope["path"]):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+# Compressão gzip das respostas JSON maiores (listagens, status de jobs). O Starlette
+# não comprime text/event-stream, então o stream SSE continua sendo entregue evento a evento
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024, compresslevel=6)
+
 @app.on_event("startup")
 async def startup_event():
     """Inicializa o banco de dados na inicialização."""
@@ -53,13 +145,22 @@ async def startup_event():
         logger.info("Documentação disponível em: http://localhost:8000/docs")
     except Exception as e:
         logger.warning(f"Não foi possível inicializar o banco de dados: {e}")
+    await run_in_threadpool(warm_up_jwks)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cancela os jobs na fila e encerra os em execução (marcados como "failed")."""
+    await run_in_threadpool(shutdown_worker)
+
+# Endpoints JSON declaram o tipo de retorno (ou response_model): assim o FastAPI
+# serializa direto para bytes JSON no pydantic-core, sem json.dumps intermediário
 
 @app.get("/")
-async def root():
+async def root() -> Dict[str, str]:
     return {"message": "Book Generator API is running. Go to /docs for Swagger UI."}
 
 @app.get("/health")
-async def health_check():
+async def health_check() -> Dict[str, str]:
     """
     Health check endpoint (público).
     Usado para monitoramento e load balancers.
@@ -71,62 +172,82 @@ async def download_file(filename: str):
     """
     Faz o download do arquivo gerado localmente (fallback).
     """
-    # Sanitiza o filename para prevenir Path Traversal
-    safe_filename = os.path.basename(filename)
-    
-    if not safe_filename or safe_filename != filename:
+    # Valida o filename com a regex pré-compilada para prevenir Path Traversal
+    if not _SAFE_FILENAME_RE.fullmatch(filename):
         raise HTTPException(status_code=400, detail="Invalid filename")
     
-    base_dir = os.getcwd()
-    file_path = os.path.join(base_dir, safe_filename)
-    
-    real_file_path = os.path.realpath(file_path)
-    real_base_dir = os.path.realpath(base_dir)
-    
-    if not real_file_path.startswith(real_base_dir):
+    safe_filename = filename
+    # Resolve o arquivo (a base já foi resolvida na importação): um symlink que aponte
+    # para fora do diretório é recusado
+    real_file_path = (_REAL_BASE_DIR / safe_filename).resolve()
+    if not real_file_path.is_relative_to(_REAL_BASE_DIR):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    if os.path.exists(real_file_path) and os.path.isfile(real_file_path):
-        return FileResponse(real_file_path, filename=safe_filename, media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    raise HTTPException(status_code=404, detail="File not found")
+    if not real_file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if DOWNLOAD_ACCEL_REDIRECT_PREFIX:
+        quoted_filename = quote(safe_filename)
+        if quoted_filename == safe_filename:
+            disposition = f'attachment; filename="{safe_filename}"'
+        else:
+            disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+        return Response(
+            media_type=DOCX_MEDIA_TYPE,
+            headers={
+                "X-Accel-Redirect": f"{DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quoted_filename}",
+                "Content-Disposition": disposition,
+            }
+        )
+    return FileResponse(real_file_path, filename=safe_filename, media_type=DOCX_MEDIA_TYPE)
 
 # ===== NOVOS ENDPOINTS PARA HISTÓRICO DE APOSTILAS =====
 
 @app.get("/apostilas/{user_id}", response_model=ApostilasListResponse)
 async def list_apostilas(
     user_id: str, 
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200, description="Quantidade máxima de apostilas"),
+    offset: int = Query(0, ge=0, description="Quantidade de apostilas a pular"),
+    db: AsyncSession = Depends(get_read_db),
     current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
-    Lista todas as apostilas de um usuário.
+    Lista as apostilas de um usuário, da mais recente para a mais antiga (paginado).
     """
-    logger.info(f"Listando apostilas do usuário: {user_id}")
-    
-    apostilas = db.query(Apostila).filter(Apostila.user_id == user_id).order_by(Apostila.created_at.desc()).all()
-    
-    response_list = []
-    for a in apostilas:
-        response_list.append(ApostilaResponse(
-            id=str(a.id),
-            user_id=a.user_id,
-            title=a.title,
-            theme=a.theme,
-            area_tecnologica=a.area_tecnologica,
-            target_audience=a.target_audience,
-            num_chapters=a.num_chapters,
-            gcs_url=a.gcs_url,
-            file_size_bytes=a.file_size_bytes,
-            created_at=a.created_at.isoformat() + "Z" if a.created_at else ""
-        ))
-    
-    return ApostilasListResponse(apostilas=response_list, total=len(response_list))
+    logger.info(f"Listando apostilas do usuário: {user_id} (limit={limit}, offset={offset})")
+    
+    # Apenas as colunas da resposta (sem gcs_blob_name), como tuplas leves em vez de
+    # objetos ORM; a ordenação usa o índice (user_id, created_at)
+    stmt = (
+        select(
+            Apostila.id,
+            Apostila.user_id,
+            Apostila.title,
+            Apostila.theme,
+            Apostila.area_tecnologica,
+            Apostila.target_audience,
+            Apostila.num_chapters,
+            Apostila.gcs_url,
+            Apostila.file_size_bytes,
+            Apostila.created_at,
+        )
+        .where(Apostila.user_id == user_id)
+        .order_by(Apostila.created_at.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    rows = (await db.execute(stmt)).all()
+    total = await db.scalar(
+        select(func.count()).select_from(Apostila).where(Apostila.user_id == user_id)
+    )
+    
+    return ApostilasListResponse(apostilas=apostila_list_adapter.validate_python(rows), total=total or 0)
 
 @app.get("/apostilas/{user_id}/{apostila_id}/download")
 async def download_apostila(
     user_id: str, 
     apostila_id: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Gera URL assinada para download de uma apostila do GCS.
@@ -134,21 +255,20 @@ async def download_apostila(
     logger.info(f"Gerando URL de download para apostila {apostila_id}")
     
     # Validar apostila_id como UUID para prevenir Open Redirect
-    try:
-        uuid_lib.UUID(apostila_id)
-    except ValueError:
+    if not _UUID_RE.fullmatch(apostila_id):
         raise HTTPException(status_code=400, detail="ID de apostila inválido")
     
-    apostila = db.query(Apostila).filter(
-        Apostila.id == apostila_id,
-        Apostila.user_id == user_id
-    ).first()
+    # Apenas a coluna usada, como linha leve (sem objeto ORM na sessão)
+    result = await db.execute(
+        select(Apostila.gcs_blob_name).where(Apostila.id == apostila_id, Apostila.user_id == user_id)
+    )
+    apostila = result.first()
     
     if not apostila:
         raise HTTPException(status_code=404, detail="Apostila não encontrada")
     
     try:
-        signed_url = generate_signed_url(apostila.gcs_blob_name, expiration_minutes=60)
+        signed_url = await run_in_threadpool(generate_signed_url, apostila.gcs_blob_name, expiration_minutes=60)
         return RedirectResponse(url=signed_url)
     except Exception as e:
         logger.error(f"Erro ao gerar URL assinada: {e}")
@@ -158,39 +278,37 @@ async def download_apostila(
 async def preview_apostila(
     user_id: str, 
     apostila_id: str, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
     Retorna o arquivo DOCX diretamente para preview no navegador.
-    Este endpoint baixa do GCS e retorna como StreamingResponse.
+    Este endpoint lê do GCS em blocos e os repassa ao cliente via StreamingResponse.
     """
-    from api.storage import download_from_gcs
-    import io
-    
     logger.info(f"Gerando preview para apostila {apostila_id}")
     
     # Validar apostila_id como UUID para prevenir Open Redirect
-    try:
-        uuid_lib.UUID(apostila_id)
-    except ValueError:
+    if not _UUID_RE.fullmatch(apostila_id):
         raise HTTPException(status_code=400, detail="ID de apostila inválido")
     
-    apostila = db.query(Apostila).filter(
-        Apostila.id == apostila_id,
-        Apostila.user_id == user_id
-    ).first()
+    # Apenas as colunas usadas, como linha leve (sem objeto ORM na sessão)
+    result = await db.execute(
+        select(Apostila.gcs_blob_name, Apostila.title).where(Apostila.id == apostila_id, Apostila.user_id == user_id)
+    )
+    apostila = result.first()
     
     if not apostila:
         raise HTTPException(status_code=404, detail="Apostila não encontrada")
     
     try:
-        # Baixar do GCS
-        file_bytes = download_from_gcs(apostila.gcs_blob_name)
+        # Ler do GCS em blocos; o primeiro é lido aqui para que falhas (ex: blob
+        # inexistente) ainda resultem em erro 500 antes de a resposta começar
+        chunks = iter_gcs_blob(apostila.gcs_blob_name)
+        first_chunk = await run_in_threadpool(next, chunks, b"")
         
         # Retornar como StreamingResponse
         return StreamingResponse(
-            io.BytesIO(file_bytes),
+            itertools.chain((first_chunk,), chunks),
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             headers={
                 "Content-Disposition": f'inline; filename="{apostila.title}.docx"',
@@ -213,7 +331,7 @@ CONVERTER_API_KEY = os.getenv("CONVERTER_API_KEY", os.getenv("API_KEY", ""))
 async def get_apostila_pdf(
     user_id: str,
     apostila_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Converte uma apostila DOCX para PDF.
@@ -226,16 +344,15 @@ async def get_apostila_pdf(
     logger.info(f"Gerando PDF para apostila {apostila_id}")
     
     # Validar apostila_id como UUID
-    try:
-        uuid_lib.UUID(apostila_id)
-    except ValueError:
+    if not _UUID_RE.fullmatch(apostila_id):
         raise HTTPException(status_code=400, detail="ID de apostila inválido")
     
     # Buscar apostila
-    apostila = db.query(Apostila).filter(
-        Apostila.id == apostila_id,
-        Apostila.user_id == user_id
-    ).first()
+    # Apenas as colunas usadas, como linha leve (sem objeto ORM na sessão)
+    result = await db.execute(
+        select(Apostila.gcs_blob_name, Apostila.title).where(Apostila.id == apostila_id, Apostila.user_id == user_id)
+    )
+    apostila = result.first()
     
     if not apostila:
         raise HTTPException(status_code=404, detail="Apostila não encontrada")
@@ -244,9 +361,9 @@ async def get_apostila_pdf(
     pdf_blob_name = apostila.gcs_blob_name.replace(".docx", ".pdf").replace(".DOCX", ".pdf")
     
     # Verificar se PDF já existe em cache
-    if blob_exists(pdf_blob_name):
+    if await run_in_threadpool(blob_exists, pdf_blob_name):
         logger.info(f"PDF encontrado em cache: {pdf_blob_name}")
-        signed_url = generate_signed_url(pdf_blob_name, expiration_minutes=60)
+        signed_url = await run_in_threadpool(generate_signed_url, pdf_blob_name, expiration_minutes=60)
         return RedirectResponse(url=signed_url)
     
     # PDF não existe, precisa converter
@@ -254,7 +371,7 @@ async def get_apostila_pdf(
     
     try:
         # 1. Baixar DOCX do GCS
-        docx_bytes = download_from_gcs(apostila.gcs_blob_name)
+        docx_bytes = await run_in_threadpool(download_from_gcs, apostila.gcs_blob_name)
         logger.info(f"DOCX baixado: {len(docx_bytes)} bytes")
         
         # 2. Enviar para serviço de conversão
@@ -265,7 +382,8 @@ async def get_apostila_pdf(
         # Montar o nome do arquivo para o serviço
         docx_filename = f"{apostila.title}.docx".replace(" ", "_")
         
-        response = requests.post(
+        response = await run_in_threadpool(
+            requests.post,
             f"{CONVERTER_SERVICE_URL}/convert",
             headers=headers,
             files={"file": (docx_filename, docx_bytes, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")},
@@ -280,11 +398,11 @@ async def get_apostila_pdf(
         logger.info(f"PDF recebido do conversor: {len(pdf_bytes)} bytes")
         
         # 3. Salvar PDF no GCS (cache)
-        upload_bytes_to_gcs(pdf_bytes, pdf_blob_name, content_type="application/pdf")
+        await run_in_threadpool(upload_bytes_to_gcs, pdf_bytes, pdf_blob_name, content_type="application/pdf")
         logger.info(f"PDF salvo em cache: {pdf_blob_name}")
         
         # 4. Gerar URL assinada
-        signed_url = generate_signed_url(pdf_blob_name, expiration_minutes=60)
+        signed_url = await run_in_threadpool(generate_signed_url, pdf_blob_name, expiration_minutes=60)
         
         return RedirectResponse(url=signed_url)
         
@@ -301,79 +419,127 @@ async def get_apostila_pdf(
 
 # ===== ENDPOINT DE GERAÇÃO COM PERSISTÊNCIA =====
 
-@app.post("/generate-book")
-async def generate_book(
-    request: BookRequest,
+# Janela mínima entre eventos de progresso no SSE: progressos emitidos em rajada
+# (ex: "capítulo concluído" seguido de "escrevendo o próximo") viram um único evento
+PROGRESS_COALESCE_SECONDS = float(os.getenv("PROGRESS_COALESCE_SECONDS", "0.1"))
+
+
+def _progress_event(type: str, text: Optional[str] = None, value: Optional[int] = None,
+                    payload: Optional[Dict[str, Any]] = None) -> ServerSentEvent:
+    """
+    Evento SSE no formato de ProgressUpdate (api/models.py), serializado direto com orjson.
+    Os itens vêm do próprio agente, então não há validação a cada evento.
+    """
+    event: ProgressUpdate = {"type": type, "text": text, "value": value, "payload": payload}
+    return ServerSentEvent(raw_data=orjson.dumps(event).decode())
+
+
+@app.post("/generate-book", response_class=EventSourceResponse, deprecated=True,
+          openapi_extra=json_body_openapi(BookRequest))
+def generate_book(
+    request: BookRequest = Depends(json_body(BookRequest)),
     current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
     Inicia a geração do livro e retorna um stream de eventos (SSE).
     Ao final, faz upload para GCS e salva no banco de dados.
+
+    Obsoleto: prefira POST /jobs/generate + GET /jobs/{job_id}/status. O job roda no
+    worker e a requisição retorna imediatamente, sem manter uma conexão aberta por
+    toda a geração (que pode ser derrubada por load balancers).
+
+    O endpoint é um gerador síncrono: o FastAPI o consome no threadpool (a geração
+    bloqueante não trava o event loop) e serializa cada ServerSentEvent via
+    pydantic-core. Cache-Control e X-Accel-Buffering são definidos pelo EventSourceResponse.
+    Enquanto o modelo não produz eventos, o FastAPI envia o comentário `: ping` a cada
+    15s, mantendo a conexão viva em proxies (Cloud Run, Nginx) durante a geração.
     """
     logger.info(f"Recebida solicitação de geração de livro: {request.theme} (user: {current_user.sub})")
     
-    # Variáveis para capturar o resultado final
-    final_export_path = None
+    # Título final capturado do estado do agente
     final_title = None
+    # Diretório exclusivo desta geração: execuções simultâneas com o mesmo título não
+    # gravam no mesmo arquivo. É removido só depois do evento "done", exceto quando o
+    # DOCX fica no disco para o download local (sem upload ao GCS)
+    export_dir = tempfile.mkdtemp(prefix="gen-")
+    keep_export_dir = False
 
-    async def event_generator():
-        nonlocal final_export_path, final_title
-        
-        try:
-            iterator = agent_book_generator(
-                area_tecnologica=request.area_tecnologica,
-                custom_audience=request.target_audience,
-                custom_theme=request.theme,
-                custom_num_chapters=request.num_chapters
-            )
+    try:
+        iterator = agent_book_generator(
+            area_tecnologica=request.area_tecnologica,
+            custom_audience=request.target_audience,
+            custom_theme=request.theme,
+            custom_num_chapters=request.num_chapters,
+            export_dir=export_dir
+        )
 
-            for item in iterator:
-                update = None
-                
-                if isinstance(item, dict):
-                    if item.get("type") == "progress":
-                        update = ProgressUpdate(
-                            type="progress",
-                            text=item.get("text"),
-                            value=item.get("value")
-                        )
-                    elif "final_state" in item:
-                        final_state = item["final_state"]
-                        status = final_state.get("status")
+        # Progresso retido dentro da janela: só o mais recente é enviado, antes do
+        # próximo item de outro tipo (conteúdo, final ou erro) ou do fim do stream
+        pending_progress = None
+        last_progress_at = 0.0
+
+        for item in iterator:
+            if isinstance(item, dict) and item.get("type") == "progress":
+                now = time.monotonic()
+                if now - last_progress_at >= PROGRESS_COALESCE_SECONDS:
+                    pending_progress = None
+                    last_progress_at = now
+                    yield _progress_event("progress", item.get("text"), item.get("value"))
+                else:
+                    pending_progress = item
+                continue
+
+            if pending_progress is not None:
+                yield _progress_event("progress", pending_progress.get("text"), pending_progress.get("value"))
+                pending_progress = None
+                last_progress_at = time.monotonic()
+
+            # Trechos de conteúdo (a maioria dos itens) primeiro; dicts despachados pelo tipo
+            if isinstance(item, str):
+                yield _progress_event("content", item)
+            elif isinstance(item, dict):
+                if "final_state" in item:
+                    final_state = item["final_state"]
+                    status = final_state.get("status")
+                    
+                    if status == "error":
+                        yield _progress_event("error", final_state.get("message", "Erro desconhecido"))
+                    else:
+                        # Caminho, nome e existência do arquivo verificados uma única vez
+                        export_path = final_state.get("export_path") or ""
+                        export_file = Path(export_path) if export_path else None
+                        filename = export_file.name if export_file else ""
+                        export_exists = export_file.is_file() if export_file else False
+                        final_title = final_state.get("title") or filename
                         
-                        if status == "error":
-                            update = ProgressUpdate(
-                                type="error",
-                                text=final_state.get("message", "Erro desconhecido")
-                            )
-                        else:
-                            export_path = final_state.get("export_path", "")
-                            filename = os.path.basename(export_path) if export_path else ""
-                            final_export_path = export_path
-                            final_title = final_state.get("title", filename)
-                            
-                            # Tentar fazer upload para GCS e salvar no banco
-                            download_url = f"/download/{filename}"  # Fallback local
-                            apostila_id = None
-                            
-                            # DEBUG: Log das condições
-                            logger.info(f"DEBUG - user_id: '{request.user_id}'")
-                            logger.info(f"DEBUG - export_path: '{export_path}'")
-                            logger.info(f"DEBUG - file exists: {os.path.exists(export_path) if export_path else False}")
-                            
-                            if request.user_id and export_path and os.path.exists(export_path):
-                                logger.info("DEBUG - Condições atendidas, tentando salvar...")
-                                try:
-                                    # Upload para GCS
-                                    logger.info(f"DEBUG - Fazendo upload para GCS: {filename}")
-                                    gcs_url, blob_name, file_size = upload_to_gcs(export_path, filename)
-                                    logger.info(f"DEBUG - Upload concluído: {gcs_url}")
-                                    
-                                    # Salvar no banco de dados
-                                    logger.info("DEBUG - Salvando no banco de dados...")
-                                    db = next(get_db())
-                                    try:
-                                        apostila = Apostila(
+                        # Tentar fazer upload para GCS e salvar no banco
+                        download_url = f"/download/{filename}"  # Fallback local
+                        apostila_id = None
+                        keep_export_dir = export_exists
+                        
+                        # DEBUG: Log das condições
+                        logger.info(f"DEBUG - user_id: '{request.user_id}', export_path: '{export_path}', file exists: {export_exists}")
+                        
+                        if request.user_id and export_exists:
+                            logger.info("DEBUG - Condições atendidas, tentando salvar...")
+                            try:
+                                # Avisa o cliente antes do envio, que pode levar alguns segundos
+                                yield _progress_event("progress", "Salvando a apostila no armazenamento...", 100)
+
+                                # Upload para GCS
+                                logger.info(f"DEBUG - Fazendo upload para GCS: {filename}")
+                                gcs_url, blob_name, file_size = upload_to_gcs(export_path, filename)
+                                logger.info(f"DEBUG - Upload concluído: {gcs_url}")
+                                
+                                # Salvar no banco de dados
+                                logger.info("DEBUG - Salvando no banco de dados...")
+                                # Sessão com escopo próprio: a transação é confirmada ao sair do bloco e a
+                                # conexão volta ao pool mesmo se o gerador for interrompido
+                                with SessionLocal() as db, db.begin():
+                                    # INSERT ... RETURNING: o id gerado volta na mesma ida ao banco,
+                                    # sem o SELECT extra do refresh
+                                    apostila_id = str(db.execute(
+                                        insert(Apostila).values(
                                             user_id=request.user_id,
                                             title=final_title,
                                             theme=request.theme,
@@ -383,81 +549,51 @@ async def generate_book(
                                             gcs_url=gcs_url,
                                             gcs_blob_name=blob_name,
                                             file_size_bytes=file_size
-                                        )
-                                        db.add(apostila)
-                                        db.commit()
-                                        db.refresh(apostila)
-                                        apostila_id = str(apostila.id)
-                                        
-                                        # Gerar URL de download via GCS
-                                        download_url = f"/apostilas/{request.user_id}/{apostila_id}/download"
-                                        logger.info(f"Apostila salva com sucesso: {apostila_id}")
-                                        
-                                        # Limpar arquivo temporário após upload
-                                        # Validar que o arquivo está no diretório temporário (previne Path Traversal)
-                                        import tempfile
-                                        temp_dir = tempfile.gettempdir()
-                                        real_path = os.path.realpath(export_path)
-                                        if real_path.startswith(os.path.realpath(temp_dir)):
-                                            try:
-                                                os.remove(export_path)
-                                                logger.info(f"Arquivo temporário removido: {export_path}")
-                                            except Exception as cleanup_err:
-                                                logger.warning(f"Não foi possível remover arquivo temporário: {cleanup_err}")
-                                        else:
-                                            logger.warning(f"Tentativa de remover arquivo fora do diretório temporário: {export_path}")
-                                    finally:
-                                        db.close()
-                                        
-                                except Exception as e:
-                                    logger.error(f"Erro ao salvar apostila: {e}")
-                                    import traceback
-                                    logger.error(traceback.format_exc())
-                                    # Continua com download local
-                            else:
-                                logger.warning(f"DEBUG - Condições NÃO atendidas para salvar. user_id={bool(request.user_id)}, export_path={bool(export_path)}, exists={os.path.exists(export_path) if export_path else False}")
-                            
-                            final_state["download_url"] = download_url
-                            if apostila_id:
-                                final_state["apostila_id"] = apostila_id
-                            
-                            update = ProgressUpdate(
-                                type="done",
-                                text="Geração concluída!",
-                                value=100,
-                                payload=final_state
-                            )
-                elif isinstance(item, str):
-                    update = ProgressUpdate(
-                        type="content",
-                        text=item
-                    )
+                                        ).returning(Apostila.id)
+                                    ).scalar_one())
+                                
+                                # Gerar URL de download via GCS
+                                download_url = f"/apostilas/{request.user_id}/{apostila_id}/download"
+                                logger.info(f"Apostila salva com sucesso: {apostila_id}")
+                                
+                                # Arquivo já no GCS: o diretório temporário é removido no finally
+                                keep_export_dir = False
+                                    
+                            except Exception as e:
+                                logger.error(f"Erro ao salvar apostila: {e}")
+                                import traceback
+                                logger.error(traceback.format_exc())
+                                # Continua com download local
+                        else:
+                            logger.warning(f"DEBUG - Condições NÃO atendidas para salvar. user_id={bool(request.user_id)}, export_path={bool(export_path)}, exists={export_exists}")
+                        
+                        final_state["download_url"] = download_url
+                        if apostila_id:
+                            final_state["apostila_id"] = apostila_id
+                        
+                        yield _progress_event("done", "Geração concluída!", 100, final_state)
+
+        if pending_progress is not None:
+            yield _progress_event("progress", pending_progress.get("text"), pending_progress.get("value"))
                 
-                if update:
-                    yield f"data: {update.model_dump_json()}\n\n"
-                    
-        except Exception as e:
-            logger.error(f"Erro durante a geração: {e}")
-            error_update = ProgressUpdate(type="error", text=str(e))
-            yield f"data: {error_update.model_dump_json()}\n\n"
-
-    return StreamingResponse(
-        event_generator(), 
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "X-Accel-Buffering": "no",  # Desabilita buffering no proxy/reverse proxy
-            "Connection": "keep-alive",
-        }
-    )
+    except Exception as e:
+        logger.error(f"Erro durante a geração: {e}")
+        yield _progress_event("error", str(e))
+    finally:
+        # A remoção fica fora do caminho do evento final: o cliente recebe o "done"
+        # primeiro (também executa se o cliente desconectar ou a geração falhar)
+        if not keep_export_dir:
+            shutil.rmtree(export_dir, ignore_errors=True)
+            logger.info(f"Diretório temporário removido: {export_dir}")
 
 
 # ===== ENDPOINTS DE JOBS (POLLING) =====
 
-@app.post("/jobs/generate", response_model=CreateJobResponse)
+@app.post("/jobs/generate", response_model=CreateJobResponse,
+          openapi_extra=json_body_openapi(CreateJobRequest))
 async def create_generation_job(
-    request: CreateJobRequest,
-    db: Session = Depends(get_db),
+    request: CreateJobRequest = Depends(json_body(CreateJobRequest)),
+    db: AsyncSession = Depends(get_async_db),
     current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
@@ -479,9 +615,10 @@ async def create_generation_job(
         current_step="Aguardando início..."
     )
     db.add(job)
-    db.commit()
-    db.refresh(job)
+    await db.commit()
     
+    # O id (uuid4) é gerado no cliente e a sessão não expira os objetos no commit,
+    # então não é preciso um SELECT de refresh para lê-lo
     job_id = str(job.id)
     logger.info(f"Job criado: {job_id}")
     
@@ -498,7 +635,7 @@ async def create_generation_job(
 @app.get("/jobs/{job_id}/status", response_model=JobStatusResponse)
 async def get_job_status(
     job_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Retorna o status atual de um job de geração.
@@ -509,26 +646,33 @@ async def get_job_status(
     2. Evita problemas de token expirado durante geração longa (até 60min)
     """
     # Validar job_id como UUID
-    try:
-        uuid_lib.UUID(job_id)
-    except ValueError:
+    if not _UUID_RE.fullmatch(job_id):
         raise HTTPException(status_code=400, detail="ID de job inválido")
     
     # Buscar job apenas pelo ID (UUID funciona como autenticação)
-    job = db.query(GenerationJob).filter(
-        GenerationJob.id == job_id
-    ).first()
+    result = await db.execute(select(GenerationJob).where(GenerationJob.id == job_id))
+    job = result.scalars().first()
     
     if not job:
         raise HTTPException(status_code=404, detail="Job não encontrado")
 
+    # Job em andamento: o conteúdo parcial está nos trechos append-only do worker
+    content = job.content
+    if content is None and not job.content_url:
+        chunks = await db.execute(
+            select(JobContentChunk.text)
+            .where(JobContentChunk.job_id == job.id)
+            .order_by(JobContentChunk.seq)
+        )
+        content = "".join(chunks.scalars().all()) or None
     
     return JobStatusResponse(
         id=str(job.id),
         status=job.status,
         progress=job.progress or 0,
         current_step=job.current_step,
-        content=job.content,
+        content=content,
+        content_url=job.content_url,
         apostila_id=str(job.apostila_id) if job.apostila_id else None,
         download_url=job.download_url,
         error_message=job.error_message,
@@ -541,30 +685,58 @@ async def get_job_status(
     )
 
 
-@app.get("/jobs/user/active")
+@app.get("/jobs/{job_id}/content")
+async def get_job_content(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Redireciona para o markdown completo de um job concluído (URL assinada do GCS).
+    Assim como o status, não requer autenticação: o job_id (UUID) funciona como segredo.
+    """
+    if not _UUID_RE.fullmatch(job_id):
+        raise HTTPException(status_code=400, detail="ID de job inválido")
+    
+    result = await db.execute(select(GenerationJob.content_url).where(GenerationJob.id == job_id))
+    if not result.scalar_one_or_none():
+        raise HTTPException(status_code=404, detail="Conteúdo não encontrado")
+    
+    try:
+        # O worker grava o blob com o UUID canônico (minúsculo), mesmo que o ID da
+        # URL venha em maiúsculas (a comparação de UUID no banco ignora a caixa)
+        signed_url = await run_in_threadpool(generate_signed_url, content_blob_name(job_id.lower()), expiration_minutes=60)
+        return RedirectResponse(url=signed_url)
+    except Exception as e:
+        logger.error(f"Erro ao gerar URL assinada do conteúdo: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao gerar link do conteúdo")
+
+
+@app.get("/jobs/user/active", response_model=ActiveJobsResponse)
 async def get_user_active_jobs(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
     Retorna jobs ativos do usuário (pending ou processing).
     Útil para reconexão após fechar o navegador.
     """
-    jobs = db.query(GenerationJob).filter(
-        GenerationJob.user_id == current_user.sub,
-        GenerationJob.status.in_(["pending", "processing"])
-    ).order_by(GenerationJob.created_at.desc()).all()
+    result = await db.execute(
+        select(GenerationJob).where(
+            GenerationJob.user_id == current_user.sub,
+            GenerationJob.status.in_(["pending", "processing"])
+        ).order_by(GenerationJob.created_at.desc())
+        # O conteúdo gerado (potencialmente grande) não faz parte do resumo
+        .options(defer(GenerationJob.content))
+    )
+    jobs = job_summary_list_adapter.validate_python(result.scalars().all())
     
-    return {
-        "jobs": [job.to_dict() for job in jobs],
-        "total": len(jobs)
-    }
+    return ActiveJobsResponse(jobs=jobs, total=len(jobs))
 
 
 # ===== ENDPOINT DE REFINAMENTO DE TEMA =====
 
 @app.post("/refine-theme", response_model=RefineThemeResponse)
-async def refine_theme(request: RefineThemeRequest, db: Session = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_user)):
+async def refine_theme(request: RefineThemeRequest, current_user: AuthenticatedUser = Depends(get_current_user)):
     """
     Refina e melhora a descrição do tema usando IA.
     Endpoint público para facilitar o uso durante a criação.
@@ -600,7 +772,7 @@ Sua tarefa é refinar e enriquecer a seguinte descrição de tema para uma apost
 
     try:
         model = get_model()
-        response = generate_with_retry(model, prompt, retries=2, delay=3)
+        response = await run_in_threadpool(generate_with_retry, model, prompt, retries=2, delay=3)
         
         if not response or not response.text:
             logger.error("Falha ao gerar refinamento do tema")
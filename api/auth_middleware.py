@@ -5,7 +5,10 @@ Nota: Migrado de python-jose para pyjwt para corrigir vulnerabilidades
 de segurança no pacote ecdsa (SNYK-PYTHON-ECDSA-6184115, SNYK-PYTHON-ECDSA-6219992).
 """
 import os
+import time
+import hashlib
 import logging
+from collections import OrderedDict
 from typing import Optional
 from functools import lru_cache
 import httpx
@@ -14,6 +17,7 @@ from jwt import PyJWKClient, PyJWKClientError
 from jwt.exceptions import InvalidTokenError, DecodeError
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,11 +29,32 @@ WSO2_JWKS_URL = os.getenv("WSO2_JWKS_URL", "https://identidade.senai.br/oauth2/j
 WSO2_ISSUER = os.getenv("WSO2_ISSUER", "https://identidade.senai.br/oauth2/token")
 WSO2_AUDIENCE = os.getenv("WSO2_AUDIENCE")  # Client ID do WSO2
 
+# Cache dos tokens já validados (sha256 do token -> payload), evitando repetir a
+# verificação RS256 a cada requisição com o mesmo token. Cada entrada vale até o
+# 'exp' do token, limitada a JWT_CACHE_TTL_SECONDS.
+JWT_CACHE_MAX_SIZE = int(os.getenv("JWT_CACHE_MAX_SIZE", "10000"))
+JWT_CACHE_TTL_SECONDS = int(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+
+# Opções de validação do jwt.decode, montadas uma única vez (não são alteradas pelo pyjwt)
+_JWT_ALGORITHMS = ["RS256"]
+_JWT_DECODE_OPTIONS = {
+    "verify_signature": True,
+    "verify_aud": False,  # Desabilitado por enquanto
+    "verify_iss": True,
+    "verify_exp": True,
+    "verify_iat": True,
+    "require": ["exp", "iat", "sub"],
+}
+
 # Esquema de segurança HTTP Bearer
 security = HTTPBearer(auto_error=False)
 
-# Cliente JWKS com cache automático
-_jwk_client: Optional[PyJWKClient] = None
+# LRU: token -> (expira_em, payload). Acessado apenas no event loop (sem lock).
+_token_cache: "OrderedDict[bytes, tuple[float, dict]]" = OrderedDict()
+
+# Cliente JWKS único do processo, com cache automático. Um 'kid' desconhecido (rotação
+# de chaves) força nova busca do JWKS, então o lifespan longo não atrasa a rotação.
+_jwk_client = PyJWKClient(WSO2_JWKS_URL, cache_keys=True, lifespan=3600)
 
 
 def get_jwk_client() -> PyJWKClient:
@@ -37,15 +62,21 @@ def get_jwk_client() -> PyJWKClient:
     Retorna o cliente JWKS com cache automático.
     O PyJWKClient gerencia o cache de chaves internamente.
     """
-    global _jwk_client
-    
-    if _jwk_client is None:
-        logger.info(f"Inicializando cliente JWKS para {WSO2_JWKS_URL}")
-        _jwk_client = PyJWKClient(WSO2_JWKS_URL, cache_keys=True, lifespan=3600)
-    
     return _jwk_client
 
 
+def warm_up_jwks() -> None:
+    """
+    Busca o JWKS antecipadamente (na inicialização), para que a primeira
+    requisição autenticada não pague a ida ao WSO2.
+    """
+    try:
+        keys = get_jwk_client().get_signing_keys()
+        logger.info(f"JWKS carregado de {WSO2_JWKS_URL} ({len(keys)} chaves)")
+    except Exception as e:
+        logger.warning(f"Não foi possível pré-carregar o JWKS: {e}")
+
+
 def get_signing_key(token: str) -> jwt.PyJWK:
     """
     Encontra a chave correta no JWKS baseado no 'kid' do token.
@@ -62,6 +93,30 @@ def get_signing_key(token: str) -> jwt.PyJWK:
         raise HTTPException(status_code=401, detail="Token inválido")
 
 
+def _get_cached_payload(cache_key: bytes) -> Optional[dict]:
+    """Retorna o payload de um token já validado, ou None se ausente/expirado."""
+    entry = _token_cache.get(cache_key)
+    if entry is None:
+        return None
+    expires_at, payload = entry
+    if expires_at <= time.time():
+        del _token_cache[cache_key]
+        return None
+    _token_cache.move_to_end(cache_key)
+    return payload
+
+
+def _cache_payload(cache_key: bytes, payload: dict) -> None:
+    """Guarda o payload validado até o exp do token (no máximo JWT_CACHE_TTL_SECONDS)."""
+    if JWT_CACHE_MAX_SIZE <= 0:
+        return
+    expires_at = min(float(payload["exp"]), time.time() + JWT_CACHE_TTL_SECONDS)
+    _token_cache[cache_key] = (expires_at, payload)
+    _token_cache.move_to_end(cache_key)
+    if len(_token_cache) > JWT_CACHE_MAX_SIZE:
+        _token_cache.popitem(last=False)
+
+
 def clear_jwks_cache():
     """Limpa o cache de JWKS (útil para forçar refresh)."""
     global _jwks_cache
@@ -71,6 +126,8 @@ def clear_jwks_cache():
 
 class AuthenticatedUser:
     """Representa um usuário autenticado extraído do JWT."""
+
+    __slots__ = ("sub", "email", "name", "raw_claims")
     
     def __init__(self, sub: str, email: Optional[str] = None, name: Optional[str] = None, raw_claims: dict = None):
         self.sub = sub
@@ -103,26 +160,24 @@ async def get_current_user(
         )
     
     token = credentials.credentials
+    cache_key = hashlib.sha256(token.encode("utf-8")).digest()
     
     try:
-        # Encontrar a chave de assinatura usando PyJWKClient
-        signing_key = get_signing_key(token)
-        
-        # Decodificar e validar o token
-        payload = jwt.decode(
-            token,
-            signing_key.key,
-            algorithms=["RS256"],
-            issuer=WSO2_ISSUER,
-            options={
-                "verify_signature": True,
-                "verify_aud": False,  # Desabilitado por enquanto
-                "verify_iss": True,
-                "verify_exp": True,
-                "verify_iat": True,
-                "require": ["exp", "iat", "sub"],
-            }
-        )
+        payload = _get_cached_payload(cache_key)
+        if payload is None:
+            # Encontrar a chave de assinatura usando PyJWKClient (pode buscar o JWKS via
+            # HTTP bloqueante, então roda no threadpool)
+            signing_key = await run_in_threadpool(get_signing_key, token)
+            
+            # Decodificar e validar o token
+            payload = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=_JWT_ALGORITHMS,
+                issuer=WSO2_ISSUER,
+                options=_JWT_DECODE_OPTIONS
+            )
+            _cache_payload(cache_key, payload)
         
         # Extrair claims
         sub = payload.get("sub")
@@ -3,7 +3,7 @@ Modelos do banco de dados para persistência de apostilas.
 """
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 from api.database import Base
 
@@ -13,6 +13,12 @@ class Apostila(Base):
     Modelo para armazenar metadados das apostilas geradas.
     """
     __tablename__ = "apostilas"
+    __table_args__ = (
+        # Busca de uma apostila do usuário (download/preview/pdf) e listagem já
+        # ordenada por data, sem etapa de ordenação
+        Index("ix_apostila_user_id_id", "user_id", "id"),
+        Index("ix_apostila_user_created", "user_id", "created_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(String(255), nullable=False, index=True)
@@ -57,8 +63,10 @@ class GenerationJob(Base):
     progress = Column(Integer, default=0)  # 0-100
     current_step = Column(String(500), nullable=True)  # "Escrevendo capítulo 3/10..."
     
-    # Conteúdo gerado (markdown acumulado)
+    # Conteúdo gerado (markdown acumulado durante a geração; ao concluir, vai para
+    # o GCS e a linha guarda apenas o link em content_url)
     content = Column(Text, nullable=True)
+    content_url = Column(String(512), nullable=True)
     
     # Resultado final
     apostila_id = Column(UUID(as_uuid=True), nullable=True)
@@ -85,6 +93,7 @@ class GenerationJob(Base):
             "progress": self.progress,
             "current_step": self.current_step,
             "content": self.content,
+            "content_url": self.content_url,
             "apostila_id": str(self.apostila_id) if self.apostila_id else None,
             "download_url": self.download_url,
             "error_message": self.error_message,
@@ -96,3 +105,20 @@ class GenerationJob(Base):
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class JobContentChunk(Base):
+    """
+    Trechos do markdown de um job em andamento, gravados em modo append-only:
+    cada trecho é escrito uma única vez, em vez de regravar o conteúdo acumulado
+    na linha do job. Ao final do job o conteúdo é consolidado e os trechos removidos.
+    """
+    __tablename__ = "generation_job_chunks"
+    __table_args__ = (
+        Index("ix_generation_job_chunks_job_seq", "job_id", "seq", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(UUID(as_uuid=True), ForeignKey("generation_jobs.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
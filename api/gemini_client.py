@@ -0,0 +1,79 @@
+"""
+Cliente REST do Gemini API sobre um pool HTTP/2 persistente.
+Todas as chamadas do processo compartilham o mesmo httpx.Client, reaproveitando
+as conexões TLS (keep-alive) e multiplexando as requisições simultâneas dos capítulos.
+"""
+import os
+import atexit
+import logging
+from typing import Iterator, Optional
+import httpx
+import orjson
+from dotenv import load_dotenv
+
+from api.llm_cache import TextResponse
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_HTTP_TIMEOUT = float(os.getenv("GEMINI_HTTP_TIMEOUT", "120"))
+
+_HTTP_CLIENT = httpx.Client(
+    http2=True,
+    timeout=GEMINI_HTTP_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+)
+atexit.register(_HTTP_CLIENT.close)
+
+
+class GeminiRestModel:
+    """
+    Substituto de `genai.GenerativeModel` para o método generate_content,
+    usando o endpoint REST `models/{modelo}:generateContent`.
+    """
+
+    def __init__(self, model_name: str, api_key: Optional[str] = None):
+        # Mesmo formato do SDK ("models/..."), usado também na chave do cache de LLM
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self._headers = {"x-goog-api-key": api_key or os.getenv("GEMINI_API_KEY", "")}
+        self._url = f"{GEMINI_API_BASE_URL}/{self.model_name}:generateContent"
+        self._stream_url = f"{GEMINI_API_BASE_URL}/{self.model_name}:streamGenerateContent?alt=sse"
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        """
+        Gera o conteúdo para o prompt (levanta exceção em erro HTTP ou resposta vazia).
+        Com stream=True retorna um iterador de respostas parciais, como o SDK.
+        """
+        payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if stream:
+            return self._generate_stream(payload)
+        response = _HTTP_CLIENT.post(self._url, headers=self._headers, json=payload)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+
+        candidates = data.get("candidates") or []
+        if not candidates:
+            feedback = data.get("promptFeedback", {})
+            raise ValueError(f"Resposta sem candidatos do Gemini: {feedback}")
+        parts = candidates[0].get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts)
+        if not text:
+            reason = candidates[0].get("finishReason", "desconhecido")
+            raise ValueError(f"Resposta vazia do Gemini (finishReason: {reason})")
+        return TextResponse(text)
+
+    def _generate_stream(self, payload: dict) -> Iterator[TextResponse]:
+        """Lê a resposta em Server-Sent Events, um trecho de texto por evento."""
+        with _HTTP_CLIENT.stream("POST", self._stream_url, headers=self._headers, json=payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = orjson.loads(line[5:])
+                for candidate in data.get("candidates", [])[:1]:
+                    parts = candidate.get("content", {}).get("parts", [])
+                    text = "".join(part.get("text", "") for part in parts)
+                    if text:
+                        yield TextResponse(text)
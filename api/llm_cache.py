@@ -0,0 +1,100 @@
+"""
+Cache em disco para respostas do modelo de linguagem.
+Evita chamadas repetidas ao Gemini para prompts idênticos (ex: desenvolvimento e testes).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de ambiente do cache (desabilitado por padrão)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "apostila-llm-cache"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+
+
+class TextResponse:
+    """
+    Resposta mínima compatível com o uso de `response.text` no agente, usada tanto
+    para as respostas do cache quanto pelo cliente REST do Gemini.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class LLMCache:
+    """
+    Cache simples baseado em arquivos: uma entrada JSON por chave,
+    com data de expiração.
+    """
+
+    def __init__(self, cache_dir: str, ttl_seconds: int = 86400):
+        self.cache_dir = Path(cache_dir)
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str) -> str:
+        """Gera a chave do cache a partir do modelo e do prompt."""
+        payload = json.dumps({"model": model_name, "prompt": prompt}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """Retorna o texto em cache ou None se ausente/expirado."""
+        path = self._path(key)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Entrada de cache inválida {path}: {e}")
+            return None
+
+        if entry.get("expires_at", 0) < time.time():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry.get("text")
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        """Grava o texto no cache (escrita atômica via arquivo temporário)."""
+        path = self._path(key)
+        entry = {
+            "expires_at": time.time() + (ttl if ttl is not None else self.ttl_seconds),
+            "text": value,
+        }
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar no cache de LLM: {e}")
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Retorna o cache de respostas, ou None se desabilitado (LLM_CACHE_ENABLED)."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    return _llm_cache
+
+
+_llm_cache = LLMCache(LLM_CACHE_DIR, LLM_CACHE_TTL_SECONDS)
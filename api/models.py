@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, TypeAdapter, field_serializer
+from typing import Annotated, Optional, List, Dict, Any, TypedDict
 from datetime import datetime
 
 class BookRequest(BaseModel):
@@ -9,15 +9,25 @@ class BookRequest(BaseModel):
     num_chapters: int = Field(5, description="Número de capítulos desejados", ge=1, le=100, example=5)
     user_id: Optional[str] = Field(None, description="ID do usuário que está gerando a apostila")
 
-class ProgressUpdate(BaseModel):
-    type: str = Field(..., description="Tipo de atualização (progress, content, error, done)")
-    text: Optional[str] = Field(None, description="Texto descritivo do progresso ou conteúdo")
-    value: Optional[int] = Field(None, description="Valor percentual do progresso (0-100)")
-    payload: Optional[Dict[str, Any]] = Field(None, description="Dados adicionais (ex: estado final)")
+class ProgressUpdate(TypedDict, total=False):
+    """
+    Formato dos eventos de progresso do stream SSE. Só circula dentro do processo
+    (montado pelo próprio servidor), por isso é um dict tipado, sem validação.
+    """
+    type: str  # Tipo de atualização (progress, content, error, done)
+    text: Optional[str]  # Texto descritivo do progresso ou conteúdo
+    value: Optional[int]  # Valor percentual do progresso (0-100)
+    payload: Optional[Dict[str, Any]]  # Dados adicionais (ex: estado final)
 
 class ApostilaResponse(BaseModel):
-    """Modelo de resposta para uma apostila."""
-    id: str
+    """
+    Modelo de resposta para uma apostila.
+    Construído direto dos objetos ORM ou das linhas da consulta (from_attributes),
+    validados pelo pydantic-core.
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: Annotated[str, BeforeValidator(str)]
     user_id: str
     title: str
     theme: str
@@ -26,15 +36,24 @@ class ApostilaResponse(BaseModel):
     num_chapters: int
     gcs_url: str
     file_size_bytes: Optional[int] = None
-    created_at: str
+    created_at: Optional[datetime] = None
     download_url: Optional[str] = None
 
+    @field_serializer("created_at")
+    def serialize_created_at(self, created_at: Optional[datetime]) -> str:
+        """Data em ISO 8601 com sufixo Z (armazenada em UTC, sem fuso)."""
+        return created_at.isoformat() + "Z" if created_at else ""
+
 class ApostilasListResponse(BaseModel):
-    """Modelo de resposta para lista de apostilas."""
+    """Modelo de resposta para lista de apostilas (total considera todas as páginas)."""
     apostilas: List[ApostilaResponse]
     total: int
 
 
+# Converte a lista de objetos ORM/linhas em uma única passada do pydantic-core
+apostila_list_adapter = TypeAdapter(List[ApostilaResponse])
+
+
 # === Modelos para Jobs de Geração (Polling) ===
 
 class CreateJobRequest(BaseModel):
@@ -57,7 +76,8 @@ class JobStatusResponse(BaseModel):
     status: str  # pending, processing, completed, failed, timeout
     progress: int
     current_step: Optional[str] = None
-    content: Optional[str] = None
+    content: Optional[str] = None  # Apenas durante a geração
+    content_url: Optional[str] = None  # Conteúdo completo após a conclusão
     apostila_id: Optional[str] = None
     download_url: Optional[str] = None
     error_message: Optional[str] = None
@@ -69,6 +89,45 @@ class JobStatusResponse(BaseModel):
     updated_at: str
 
 
+class JobSummaryResponse(BaseModel):
+    """
+    Resumo de um job para a lista de jobs ativos (sem o conteúdo gerado).
+    Construído direto dos objetos ORM (from_attributes), validados pelo pydantic-core.
+    """
+    model_config = ConfigDict(from_attributes=True)
+
+    id: Annotated[str, BeforeValidator(str)]
+    user_id: str
+    status: str
+    progress: Optional[int] = None
+    current_step: Optional[str] = None
+    content_url: Optional[str] = None
+    apostila_id: Annotated[Optional[str], BeforeValidator(lambda v: None if v is None else str(v))] = None
+    download_url: Optional[str] = None
+    error_message: Optional[str] = None
+    theme: str
+    area_tecnologica: str
+    target_audience: str
+    num_chapters: int
+    author_name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    @field_serializer("created_at", "updated_at")
+    def serialize_timestamps(self, value: Optional[datetime]) -> Optional[str]:
+        """Datas em ISO 8601, como em GenerationJob.to_dict."""
+        return value.isoformat() if value else None
+
+class ActiveJobsResponse(BaseModel):
+    """Response com os jobs ativos (pending ou processing) do usuário."""
+    jobs: List[JobSummaryResponse]
+    total: int
+
+
+# Converte a lista de jobs ORM em uma única passada do pydantic-core
+job_summary_list_adapter = TypeAdapter(List[JobSummaryResponse])
+
+
 # === Modelos para Refinamento de Tema ===
 
 class RefineThemeRequest(BaseModel):
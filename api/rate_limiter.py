@@ -0,0 +1,57 @@
+"""
+Limitador de taxa (token bucket) para as chamadas ao Gemini.
+Só bloqueia quando a cota por minuto está realmente esgotada, em vez de
+esperar um intervalo fixo entre chamadas.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Requisições por minuto permitidas ao modelo (0 desabilita o limitador)
+GEMINI_RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "60"))
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: `rate_per_minute` fichas reabastecidas de forma
+    contínua, com rajada máxima de `capacity` chamadas.
+    """
+
+    def __init__(self, rate_per_minute: int, capacity: Optional[int] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self) -> None:
+        """Consome uma ficha, aguardando apenas se o bucket estiver vazio."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            logger.debug(f"Limite de requisições atingido; aguardando {wait:.2f}s")
+            time.sleep(wait)
+
+
+def get_rate_limiter() -> Optional[TokenBucket]:
+    """Retorna o limitador compartilhado, ou None se desabilitado (GEMINI_RPM_LIMIT=0)."""
+    return _rate_limiter
+
+
+_rate_limiter = TokenBucket(GEMINI_RPM_LIMIT) if GEMINI_RPM_LIMIT > 0 else None
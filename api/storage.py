@@ -2,9 +2,14 @@
 Módulo para upload e gerenciamento de arquivos no Google Cloud Storage.
 """
 import os
+import time
 import logging
-from datetime import timedelta
+import functools
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from dotenv import load_dotenv
 import google.auth
 import google.auth.transport.requests
@@ -15,16 +20,35 @@ logger = logging.getLogger(__name__)
 
 # Variável de ambiente para o bucket
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+# Arquivos acima deste tamanho são enviados em partes paralelas (XML multipart upload,
+# mínimo de 5 MiB por parte); cada parte tem este tamanho
+GCS_UPLOAD_CHUNK_SIZE = int(os.getenv("GCS_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# Threads enviando partes simultaneamente no upload paralelo
+GCS_UPLOAD_MAX_WORKERS = int(os.getenv("GCS_UPLOAD_MAX_WORKERS", "8"))
 
+# URLs assinadas reaproveitadas enquanto ainda valem ao menos metade do prazo pedido,
+# evitando nova assinatura V4 (e a chamada ao IAM signBlob no Cloud Run) a cada download
+SIGNED_URL_CACHE_MAX_SIZE = 1024
+_signed_url_cache: dict[tuple[str, int], tuple[str, float]] = {}
+_signed_url_cache_lock = threading.Lock()
 
+
+@functools.lru_cache(maxsize=1)
 def get_storage_client():
     """
-    Retorna o cliente do Google Cloud Storage.
+    Retorna o cliente do Google Cloud Storage, criado uma única vez por processo
+    (credenciais e pool de conexões HTTPS reaproveitados entre as chamadas).
     Usa Application Default Credentials ou GOOGLE_APPLICATION_CREDENTIALS.
     """
     return storage.Client()
 
 
+@functools.lru_cache(maxsize=1)
+def _get_bucket():
+    """Retorna o handle do bucket GCS_BUCKET_NAME (sem requisição à API)."""
+    return get_storage_client().bucket(GCS_BUCKET_NAME)
+
+
 def upload_to_gcs(file_path: str, blob_name: str = None) -> tuple[str, str, int]:
     """
     Faz upload de um arquivo para o Google Cloud Storage.
@@ -39,25 +63,30 @@ def upload_to_gcs(file_path: str, blob_name: str = None) -> tuple[str, str, int]
     if not GCS_BUCKET_NAME:
         raise ValueError("GCS_BUCKET_NAME não configurado nas variáveis de ambiente")
     
-    if not blob_name:
-        blob_name = os.path.basename(file_path)
-    
     # Adicionar prefixo de pasta com timestamp para organização
-    from datetime import datetime
     date_prefix = datetime.utcnow().strftime("%Y/%m/%d")
-    blob_name = f"apostilas/{date_prefix}/{blob_name}"
+    blob_name = f"apostilas/{date_prefix}/{blob_name or os.path.basename(file_path)}"
     
     logger.info(f"Fazendo upload de {file_path} para gs://{GCS_BUCKET_NAME}/{blob_name}")
     
-    client = get_storage_client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
-    blob = bucket.blob(blob_name)
-    
-    # Fazer upload
-    blob.upload_from_filename(file_path)
-    
+    bucket = _get_bucket()
     # Obter tamanho do arquivo
     file_size = os.path.getsize(file_path)
+
+    blob = bucket.blob(blob_name)
+    
+    # Fazer upload: arquivos pequenos vão em uma única requisição; os grandes são
+    # fatiados e as partes enviadas em paralelo (threads, sem carregar tudo em memória)
+    if file_size > GCS_UPLOAD_CHUNK_SIZE:
+        transfer_manager.upload_chunks_concurrently(
+            file_path,
+            blob,
+            chunk_size=GCS_UPLOAD_CHUNK_SIZE,
+            max_workers=GCS_UPLOAD_MAX_WORKERS,
+            worker_type=transfer_manager.THREAD,
+        )
+    else:
+        blob.upload_from_filename(file_path)
     
     # Gerar URL pública (ou usar signed URL para acesso controlado)
     public_url = f"gs://{GCS_BUCKET_NAME}/{blob_name}"
@@ -84,10 +113,15 @@ def generate_signed_url(blob_name: str, expiration_minutes: int = 60) -> str:
     if not GCS_BUCKET_NAME:
         raise ValueError("GCS_BUCKET_NAME não configurado nas variáveis de ambiente")
     
+    cache_key = (blob_name, expiration_minutes)
+    with _signed_url_cache_lock:
+        cached = _signed_url_cache.get(cache_key)
+    if cached and cached[1] - time.time() >= expiration_minutes * 60 / 2:
+        return cached[0]
+    
     logger.info(f"Gerando URL assinada para {blob_name}")
     
-    client = get_storage_client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
+    bucket = _get_bucket()
     blob = bucket.blob(blob_name)
     
     # Obter credenciais padrão
@@ -118,6 +152,12 @@ def generate_signed_url(blob_name: str, expiration_minutes: int = 60) -> str:
     
     logger.info(f"URL assinada gerada com expiração de {expiration_minutes} minutos")
     
+    with _signed_url_cache_lock:
+        if len(_signed_url_cache) >= SIGNED_URL_CACHE_MAX_SIZE:
+            # Descarta a entrada mais antiga (dict mantém a ordem de inserção)
+            _signed_url_cache.pop(next(iter(_signed_url_cache)))
+        _signed_url_cache[cache_key] = (url, time.time() + expiration_minutes * 60)
+    
     return url
 
 
@@ -135,8 +175,7 @@ def delete_from_gcs(blob_name: str) -> bool:
         raise ValueError("GCS_BUCKET_NAME não configurado nas variáveis de ambiente")
     
     try:
-        client = get_storage_client()
-        bucket = client.bucket(GCS_BUCKET_NAME)
+        bucket = _get_bucket()
         blob = bucket.blob(blob_name)
         blob.delete()
         logger.info(f"Arquivo {blob_name} deletado com sucesso")
@@ -161,8 +200,7 @@ def download_from_gcs(blob_name: str) -> bytes:
     
     logger.info(f"Baixando arquivo {blob_name} do GCS")
     
-    client = get_storage_client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
+    bucket = _get_bucket()
     blob = bucket.blob(blob_name)
     
     content = blob.download_as_bytes()
@@ -172,6 +210,30 @@ def download_from_gcs(blob_name: str) -> bytes:
     return content
 
 
+def iter_gcs_blob(blob_name: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Lê um arquivo do Google Cloud Storage em blocos, sem carregá-lo inteiro em memória.
+    
+    Args:
+        blob_name: Nome do blob no GCS
+        chunk_size: Tamanho de cada bloco em bytes
+    
+    Yields:
+        Blocos do conteúdo do arquivo
+    """
+    if not GCS_BUCKET_NAME:
+        raise ValueError("GCS_BUCKET_NAME não configurado nas variáveis de ambiente")
+    
+    logger.info(f"Lendo arquivo {blob_name} do GCS em blocos de {chunk_size} bytes")
+    
+    bucket = _get_bucket()
+    blob = bucket.blob(blob_name)
+    
+    with blob.open("rb", chunk_size=chunk_size) as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
 def blob_exists(blob_name: str) -> bool:
     """
     Verifica se um blob existe no GCS.
@@ -186,8 +248,7 @@ def blob_exists(blob_name: str) -> bool:
         return False
     
     try:
-        client = get_storage_client()
-        bucket = client.bucket(GCS_BUCKET_NAME)
+        bucket = _get_bucket()
         blob = bucket.blob(blob_name)
         return blob.exists()
     except Exception as e:
@@ -212,8 +273,7 @@ def upload_bytes_to_gcs(content: bytes, blob_name: str, content_type: str = "app
     
     logger.info(f"Fazendo upload de bytes para gs://{GCS_BUCKET_NAME}/{blob_name}")
     
-    client = get_storage_client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
+    bucket = _get_bucket()
     blob = bucket.blob(blob_name)
     
     blob.upload_from_string(content, content_type=content_type)
@@ -2,23 +2,89 @@
 Worker para executar geração de apostilas em background.
 Permite polling em vez de conexões longas (SSE).
 """
-import threading
 import logging
 import os
+import time
+import shutil
 import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import insert, update, delete, bindparam
 from sqlalchemy.orm import Session
 
 from api.database import SessionLocal
-from api.db_models import GenerationJob, Apostila
+from api.db_models import GenerationJob, Apostila, JobContentChunk
 from api.agent import agent_book_generator
-from api.storage import upload_to_gcs
+from api.storage import upload_to_gcs, upload_bytes_to_gcs
 
 logger = logging.getLogger(__name__)
 
 # Timeout máximo para jobs (60 minutos)
 JOB_TIMEOUT_MINUTES = 60
 
+# Intervalo mínimo entre gravações do conteúdo parcial (os trechos chegam em rajadas);
+# mudanças de progresso são gravadas na hora e levam junto os trechos pendentes
+CONTENT_COMMIT_INTERVAL_SECONDS = 0.5
+
+# UPDATE direto (Core) para os avanços de progresso durante a geração: sem dirty-check
+# do unit of work nem sincronização da sessão a cada gravação. As colunas do SET vêm
+# dos parâmetros de cada execução.
+_JOB_PROGRESS_UPDATE = (
+    update(GenerationJob)
+    .where(GenerationJob.id == bindparam("job_pk"))
+    .execution_options(synchronize_session=False)
+)
+
+# Jobs executados ao mesmo tempo; os excedentes aguardam na fila como "pending"
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+
+# Pool fixo de threads reaproveitadas entre os jobs (limita memória e conexões abertas).
+# As threads não são daemon: no desligamento, shutdown_worker cancela a fila e sinaliza
+# os jobs em execução para pararem, em vez de a saída do processo esperar a geração inteira
+_EXECUTOR = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="generation-job")
+# Jobs enfileirados ou em execução neste processo (job_id -> Future)
+_active_jobs: dict[str, Future] = {}
+_active_jobs_lock = threading.Lock()
+# Desligamento em andamento: os jobs em execução param no próximo item do agente
+_shutting_down = threading.Event()
+SHUTDOWN_ERROR_MESSAGE = "Job interrompido pelo reinício do servidor. Gere a apostila novamente."
+
+
+def job_workdir(job_id: str) -> Path:
+    """Diretório temporário exclusivo do job, onde o agente salva o DOCX exportado."""
+    return Path(tempfile.gettempdir()) / f"gen-{job_id}"
+
+
+def content_blob_name(job_id: str) -> str:
+    """Nome do blob no GCS com o markdown completo de um job."""
+    return f"jobs/{job_id}/content.md"
+
+
+def offload_job_content(job: GenerationJob, content: str) -> None:
+    """
+    Envia o markdown final do job para o GCS e guarda apenas o link em content_url,
+    para que o polling de status não trafegue o livro inteiro a cada consulta.
+    Em caso de falha, o conteúdo é gravado na coluna content.
+    """
+    if not content:
+        return
+    try:
+        upload_bytes_to_gcs(content.encode("utf-8"), content_blob_name(str(job.id)),
+                            content_type="text/markdown; charset=utf-8")
+        job.content_url = f"/jobs/{job.id}/content"
+        job.content = None
+    except Exception as e:
+        logger.warning(f"Não foi possível enviar o conteúdo do job {job.id} ao GCS: {e}")
+        job.content = content
+
+
+def drop_content_chunks(db: Session, job_pk) -> None:
+    """Remove os trechos parciais do job (conteúdo já consolidado no job ou no GCS)."""
+    db.execute(delete(JobContentChunk).where(JobContentChunk.job_id == job_pk))
+
 
 def run_generation_job(job_id: str):
     """
@@ -26,6 +92,9 @@ def run_generation_job(job_id: str):
     Atualiza o banco de dados com o progresso.
     """
     db: Session = SessionLocal()
+    # O DOCX vai para um diretório só deste job: a limpeza remove o diretório inteiro
+    # no finally (também em falhas), sem validar caminhos arquivo a arquivo
+    workdir = job_workdir(job_id)
     
     try:
         # Buscar o job
@@ -33,6 +102,7 @@ def run_generation_job(job_id: str):
         if not job:
             logger.error(f"Job {job_id} não encontrado")
             return
+        job_pk = job.id
         
         # Marcar como processing
         job.status = "processing"
@@ -41,36 +111,71 @@ def run_generation_job(job_id: str):
         
         logger.info(f"Iniciando job {job_id}: {job.theme}")
         
-        # Variáveis para acumular conteúdo
-        accumulated_content = ""
+        # Variáveis para acumular conteúdo: os trechos ainda não gravados
+        # (content_chunks[flushed_chunks:]) viram uma linha de JobContentChunk por gravação
+        content_chunks: list[str] = []
+        flushed_chunks = 0
+        chunk_seq = 0
+        last_commit_at = time.monotonic()
+        # Último progresso gravado, comparado localmente (ler job.progress após o
+        # commit recarregaria a linha inteira)
+        last_progress = None
         final_export_path = None
         final_title = None
+        # Prazo calculado uma vez: job.created_at expira a cada commit e exigiria novo SELECT
+        deadline = job.created_at + timedelta(minutes=JOB_TIMEOUT_MINUTES)
         
         # Executar geração
         try:
+            workdir.mkdir(parents=True, exist_ok=True)
             iterator = agent_book_generator(
                 area_tecnologica=job.area_tecnologica,
                 custom_audience=job.target_audience,
                 custom_theme=job.theme,
                 custom_num_chapters=job.num_chapters,
-                author_name=job.author_name or "SENAI"
+                author_name=job.author_name or "SENAI",
+                export_dir=str(workdir)
             )
             
             for item in iterator:
                 # Verificar timeout
-                elapsed = datetime.utcnow() - job.created_at
-                if elapsed > timedelta(minutes=JOB_TIMEOUT_MINUTES):
+                if datetime.utcnow() > deadline:
+                    job.content = "".join(content_chunks)
+                    drop_content_chunks(db, job_pk)
                     job.status = "timeout"
                     job.error_message = f"Job excedeu o tempo máximo de {JOB_TIMEOUT_MINUTES} minutos"
                     db.commit()
                     logger.warning(f"Job {job_id} timeout")
                     return
                 
+                # Desligamento do servidor: encerra o job em vez de segurar a saída do processo
+                if _shutting_down.is_set():
+                    job.content = "".join(content_chunks)
+                    drop_content_chunks(db, job_pk)
+                    job.status = "failed"
+                    job.error_message = SHUTDOWN_ERROR_MESSAGE
+                    db.commit()
+                    logger.warning(f"Job {job_id} interrompido pelo desligamento do servidor")
+                    return
+                
                 if isinstance(item, dict):
                     if item.get("type") == "progress":
-                        job.progress = item.get("value", 0)
-                        job.current_step = item.get("text", "")
-                        db.commit()
+                        progress = (item.get("value", 0), item.get("text", ""))
+                        # Só grava quando o progresso muda de fato
+                        if progress != last_progress:
+                            last_progress = progress
+                            db.execute(_JOB_PROGRESS_UPDATE, {
+                                "job_pk": job_pk, "progress": progress[0], "current_step": progress[1]
+                            })
+                            if flushed_chunks < len(content_chunks):
+                                db.execute(insert(JobContentChunk), {
+                                    "job_id": job_pk, "seq": chunk_seq,
+                                    "text": "".join(content_chunks[flushed_chunks:])
+                                })
+                                chunk_seq += 1
+                                flushed_chunks = len(content_chunks)
+                            db.commit()
+                            last_commit_at = time.monotonic()
                     
                     # Capturar estado final (vem como {"final_state": {...}})
                     if "final_state" in item:
@@ -86,10 +191,20 @@ def run_generation_job(job_id: str):
                         final_title = item.get("title")
                 
                 elif isinstance(item, str):
-                    # Acumular conteúdo markdown
-                    accumulated_content += item
-                    job.content = accumulated_content
-                    db.commit()
+                    # Acumular conteúdo markdown, gravando no máximo a cada intervalo
+                    # (apenas os trechos novos, como uma linha de JobContentChunk)
+                    content_chunks.append(item)
+                    if time.monotonic() - last_commit_at >= CONTENT_COMMIT_INTERVAL_SECONDS:
+                        db.execute(insert(JobContentChunk), {
+                            "job_id": job_pk, "seq": chunk_seq,
+                            "text": "".join(content_chunks[flushed_chunks:])
+                        })
+                        chunk_seq += 1
+                        flushed_chunks = len(content_chunks)
+                        db.commit()
+                        last_commit_at = time.monotonic()
+            
+            accumulated_content = "".join(content_chunks)
             
             # Geração concluída - fazer upload para GCS
             if final_export_path and os.path.exists(final_export_path):
@@ -99,52 +214,48 @@ def run_generation_job(job_id: str):
                     # Upload para GCS
                     gcs_url, blob_name, file_size = upload_to_gcs(final_export_path, filename)
                     
-                    # Criar registro de Apostila
-                    apostila = Apostila(
-                        user_id=job.user_id,
-                        title=final_title or job.theme,
-                        theme=job.theme,
-                        area_tecnologica=job.area_tecnologica,
-                        target_audience=job.target_audience,
-                        num_chapters=job.num_chapters,
-                        gcs_url=gcs_url,
-                        gcs_blob_name=blob_name,
-                        file_size_bytes=file_size
-                    )
-                    db.add(apostila)
-                    db.commit()
-                    db.refresh(apostila)
+                    # Criar registro de Apostila (INSERT ... RETURNING, sem SELECT de refresh);
+                    # o commit abaixo grava a apostila e o resultado do job juntos
+                    apostila_id = db.execute(
+                        insert(Apostila).values(
+                            user_id=job.user_id,
+                            title=final_title or job.theme,
+                            theme=job.theme,
+                            area_tecnologica=job.area_tecnologica,
+                            target_audience=job.target_audience,
+                            num_chapters=job.num_chapters,
+                            gcs_url=gcs_url,
+                            gcs_blob_name=blob_name,
+                            file_size_bytes=file_size
+                        ).returning(Apostila.id)
+                    ).scalar_one()
                     
                     # Atualizar job com resultado
-                    job.apostila_id = apostila.id
-                    job.download_url = f"/apostilas/{job.user_id}/{apostila.id}/download"
+                    job.apostila_id = apostila_id
+                    job.download_url = f"/apostilas/{job.user_id}/{apostila_id}/download"
                     job.status = "completed"
                     job.progress = 100
                     job.current_step = "Geração concluída!"
+                    offload_job_content(job, accumulated_content)
+                    drop_content_chunks(db, job_pk)
                     db.commit()
                     
-                    logger.info(f"Job {job_id} concluído com sucesso. Apostila: {apostila.id}")
-                    
-                    # Limpar arquivo temporário
-                    temp_dir = tempfile.gettempdir()
-                    real_path = os.path.realpath(final_export_path)
-                    if real_path.startswith(os.path.realpath(temp_dir)):
-                        try:
-                            os.remove(final_export_path)
-                            logger.info(f"Arquivo temporário removido: {final_export_path}")
-                        except Exception as cleanup_err:
-                            logger.warning(f"Não foi possível remover arquivo temporário: {cleanup_err}")
+                    logger.info(f"Job {job_id} concluído com sucesso. Apostila: {apostila_id}")
                     
                 except Exception as upload_err:
                     logger.error(f"Erro no upload para GCS: {upload_err}")
                     job.status = "failed"
                     job.error_message = f"Erro no upload: {str(upload_err)}"
+                    job.content = accumulated_content
+                    drop_content_chunks(db, job_pk)
                     db.commit()
             else:
                 # Sem arquivo de exportação
                 job.status = "completed"
                 job.progress = 100
                 job.current_step = "Geração concluída (sem arquivo)"
+                offload_job_content(job, accumulated_content)
+                drop_content_chunks(db, job_pk)
                 db.commit()
                 logger.warning(f"Job {job_id} concluído mas sem arquivo de exportação")
         
@@ -154,6 +265,8 @@ def run_generation_job(job_id: str):
             logger.error(traceback.format_exc())
             job.status = "failed"
             job.error_message = str(gen_err)
+            job.content = "".join(content_chunks)
+            drop_content_chunks(db, job_pk)
             db.commit()
     
     except Exception as e:
@@ -171,18 +284,46 @@ def run_generation_job(job_id: str):
     
     finally:
         db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
 
 
-def start_generation_job(job_id: str):
+def start_generation_job(job_id: str) -> Future:
     """
-    Inicia um job de geração em uma thread separada.
+    Enfileira um job de geração no pool de threads do worker.
     """
-    thread = threading.Thread(
-        target=run_generation_job,
-        args=(job_id,),
-        daemon=True,
-        name=f"generation-job-{job_id}"
-    )
-    thread.start()
-    logger.info(f"Thread iniciada para job {job_id}")
-    return thread
+    future = _EXECUTOR.submit(run_generation_job, job_id)
+    with _active_jobs_lock:
+        _active_jobs[job_id] = future
+    future.add_done_callback(lambda _: _forget_job(job_id))
+    logger.info(f"Job {job_id} enfileirado no worker")
+    return future
+
+
+def _forget_job(job_id: str) -> None:
+    with _active_jobs_lock:
+        _active_jobs.pop(job_id, None)
+
+
+def shutdown_worker() -> None:
+    """
+    Desligamento do processo: cancela os jobs ainda na fila e sinaliza os jobs em
+    execução para pararem no próximo item. Todos são marcados como "failed" no banco,
+    em vez de ficarem "pending"/"processing" para sempre.
+    """
+    _shutting_down.set()
+    # Lista capturada antes do cancelamento, que remove os jobs da fila de _active_jobs
+    with _active_jobs_lock:
+        job_ids = [uuid.UUID(str(job_id)) for job_id in _active_jobs]
+    _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    if not job_ids:
+        return
+    try:
+        with SessionLocal() as db, db.begin():
+            db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id.in_(job_ids), GenerationJob.status.in_(["pending", "processing"]))
+                .values(status="failed", error_message=SHUTDOWN_ERROR_MESSAGE)
+            )
+        logger.warning(f"{len(job_ids)} job(s) interrompido(s) pelo desligamento do servidor")
+    except Exception as e:
+        logger.error(f"Não foi possível marcar os jobs interrompidos: {e}")
@@ -0,0 +1,48 @@
+import random
+import time
+
+from api import agent
+from api.llm_cache import TextResponse
+
+
+def test_merge_chapters_keeps_unchanged_chapters():
+    current = {1: {"title": "A"}, 2: {"title": "B"}}
+    merged = agent._merge_chapters(current, {2: {"title": "B", "content": "texto"}})
+
+    assert merged == {1: {"title": "A"}, 2: {"title": "B", "content": "texto"}}
+    assert current[2] == {"title": "B"}  # o estado anterior não é alterado
+
+
+def test_merge_chapters_accepts_empty_state():
+    assert agent._merge_chapters(None, {1: {"title": "A"}}) == {1: {"title": "A"}}
+
+
+def test_write_all_chapters_keeps_outline_order(monkeypatch):
+    def fake_generate(model, prompt):
+        # Respostas terminam fora de ordem; o resultado deve seguir o sumário
+        time.sleep(random.uniform(0, 0.02))
+        num = prompt.split("Escreva o Capítulo ")[1].split(":")[0]
+        return TextResponse(f"conteúdo {num}")
+
+    monkeypatch.setattr(agent, "generate_with_retry", fake_generate)
+    chapters = {n: {"title": f"Cap {n}", "description": "d"} for n in range(1, 7)}
+    state = {"title": "Livro", "theme": "t", "target_audience": "p", "chapters": chapters}
+
+    result = agent.write_all_chapters(state, model=None)
+
+    assert list(result["chapters"]) == [1, 2, 3, 4, 5, 6]
+    assert [c["content"] for c in result["chapters"].values()] == [f"conteúdo {n}" for n in range(1, 7)]
+    assert result["current_chapter"] == 7
+    assert result["status"] == "all_chapters_written"
+
+
+def test_write_all_chapters_fails_when_a_chapter_fails(monkeypatch):
+    monkeypatch.setattr(agent, "generate_with_retry",
+                        lambda model, prompt: None if "Escreva o Capítulo 2:" in prompt else TextResponse("ok"))
+    chapters = {n: {"title": f"Cap {n}", "description": "d"} for n in range(1, 4)}
+    state = {"title": "Livro", "theme": "t", "target_audience": "p", "chapters": chapters}
+
+    result = agent.write_all_chapters(state, model=None)
+
+    assert result["status"] == "error"
+    assert "capítulo 2" in result["message"]
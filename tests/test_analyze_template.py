@@ -0,0 +1,22 @@
+from docx import Document
+from docx.enum.text import WD_BREAK
+
+from analyze_template import analyze
+
+
+def test_paragraph_text_keeps_tabs_and_line_breaks(tmp_path):
+    doc = Document()
+    doc.add_paragraph('A\tB {{NOME}}')
+    paragraph = doc.add_paragraph('Linha 1')
+    paragraph.add_run().add_break()
+    paragraph.add_run('Linha 2')
+    paragraph.add_run().add_break(WD_BREAK.PAGE)
+    path = tmp_path / 'template.docx'
+    doc.save(path)
+
+    report = analyze(path)
+
+    assert report['ph_texts'] == ['A\tB {{NOME}}']
+    assert list(report['ph_names']) == ['NOME']
+    assert [p.text for p in Document(path).paragraphs] == ['A\tB {{NOME}}', 'Linha 1\nLinha 2']
+    assert report['structure_lines'][1].endswith('Normal: Linha 1\nLinha 2')
@@ -0,0 +1,48 @@
+import pytest
+
+from api.app import _SAFE_FILENAME_RE, _UUID_RE
+
+
+@pytest.mark.parametrize("value", [
+    "0b7c4a8e-5f3d-4c2a-9e1b-7d6f5a4b3c2d",
+    "0B7C4A8E-5F3D-4C2A-9E1B-7D6F5A4B3C2D",
+])
+def test_uuid_accepts_canonical_ids(value):
+    assert _UUID_RE.fullmatch(value)
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "0b7c4a8e5f3d4c2a9e1b7d6f5a4b3c2d",
+    "{0b7c4a8e-5f3d-4c2a-9e1b-7d6f5a4b3c2d}",
+    "0b7c4a8e-5f3d-4c2a-9e1b-7d6f5a4b3c2d/../x",
+    "0b7c4a8e-5f3d-4c2a-9e1b-7d6f5a4b3c2g",
+])
+def test_uuid_rejects_other_values(value):
+    assert not _UUID_RE.fullmatch(value)
+
+
+@pytest.mark.parametrize("value", [
+    "Livro.docx",
+    "Introdução_à_Programação.docx",
+    "a.b.docx",
+])
+def test_safe_filename_accepts_docx_names(value):
+    assert _SAFE_FILENAME_RE.fullmatch(value)
+
+
+@pytest.mark.parametrize("value", [
+    ".docx",
+    "..docx",
+    ".env.docx",
+    "../x.docx",
+    "dir/x.docx",
+    "dir\\x.docx",
+    "a\x00b.docx",
+    "a\nb.docx",
+    "Livro.pdf",
+    "Livro.docx.exe",
+    "a" * 201 + ".docx",
+])
+def test_safe_filename_rejects_unsafe_names(value):
+    assert not _SAFE_FILENAME_RE.fullmatch(value)
@@ -0,0 +1,53 @@
+import pytest
+
+from api import auth_middleware as am
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(am, "_token_cache", am.OrderedDict())
+    monkeypatch.setattr(am, "JWT_CACHE_MAX_SIZE", 2)
+    monkeypatch.setattr(am, "JWT_CACHE_TTL_SECONDS", 300)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(am.time, "time", lambda: now[0])
+    return now
+
+
+def test_cached_payload_expires_at_token_exp(clock):
+    payload = {"sub": "u", "exp": clock[0] + 60}
+    am._cache_payload(b"k", payload)
+
+    clock[0] += 59
+    assert am._get_cached_payload(b"k") is payload
+    clock[0] += 1
+    assert am._get_cached_payload(b"k") is None
+    assert b"k" not in am._token_cache
+
+
+def test_cached_payload_is_capped_by_ttl(clock):
+    am._cache_payload(b"k", {"sub": "u", "exp": clock[0] + 3600})
+
+    clock[0] += 299
+    assert am._get_cached_payload(b"k") is not None
+    clock[0] += 1
+    assert am._get_cached_payload(b"k") is None
+
+
+def test_least_recently_used_token_is_evicted(clock):
+    for key in (b"a", b"b"):
+        am._cache_payload(key, {"sub": key.decode(), "exp": clock[0] + 60})
+    am._get_cached_payload(b"a")  # "a" passa a ser o mais recente
+    am._cache_payload(b"c", {"sub": "c", "exp": clock[0] + 60})
+
+    assert list(am._token_cache) == [b"a", b"c"]
+
+
+def test_cache_disabled_with_zero_size(monkeypatch, clock):
+    monkeypatch.setattr(am, "JWT_CACHE_MAX_SIZE", 0)
+    am._cache_payload(b"k", {"sub": "u", "exp": clock[0] + 60})
+
+    assert am._get_cached_payload(b"k") is None
@@ -0,0 +1,71 @@
+import pytest
+
+from api import storage
+
+
+class FakeBlob:
+    def __init__(self, calls, name):
+        self.calls = calls
+        self.name = name
+
+    def generate_signed_url(self, **kwargs):
+        self.calls.append(self.name)
+        return f"https://signed/{self.name}?n={len(self.calls)}"
+
+
+class FakeBucket:
+    def __init__(self):
+        self.calls = []
+
+    def blob(self, name):
+        return FakeBlob(self.calls, name)
+
+
+class FakeCredentials:
+    def sign_bytes(self, data):
+        return b""
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    fake = FakeBucket()
+    monkeypatch.setattr(storage, "GCS_BUCKET_NAME", "bucket")
+    monkeypatch.setattr(storage, "_get_bucket", lambda: fake)
+    monkeypatch.setattr(storage.google.auth, "default", lambda: (FakeCredentials(), "projeto"))
+    monkeypatch.setattr(storage, "_signed_url_cache", {})
+    return fake
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(storage.time, "time", lambda: now[0])
+    return now
+
+
+def test_signed_url_reused_until_half_of_its_lifetime(bucket, clock):
+    first = storage.generate_signed_url("a.docx", expiration_minutes=60)
+
+    clock[0] += 30 * 60
+    assert storage.generate_signed_url("a.docx", expiration_minutes=60) == first
+    assert bucket.calls == ["a.docx"]
+
+    clock[0] += 1
+    assert storage.generate_signed_url("a.docx", expiration_minutes=60) != first
+    assert bucket.calls == ["a.docx", "a.docx"]
+
+
+def test_signed_url_cache_is_keyed_by_blob_and_expiration(bucket, clock):
+    storage.generate_signed_url("a.docx", expiration_minutes=60)
+    storage.generate_signed_url("a.docx", expiration_minutes=10)
+    storage.generate_signed_url("b.docx", expiration_minutes=60)
+
+    assert bucket.calls == ["a.docx", "a.docx", "b.docx"]
+
+
+def test_signed_url_cache_drops_oldest_entry_when_full(bucket, clock, monkeypatch):
+    monkeypatch.setattr(storage, "SIGNED_URL_CACHE_MAX_SIZE", 2)
+    for name in ("a.docx", "b.docx", "c.docx"):
+        storage.generate_signed_url(name)
+
+    assert [key[0] for key in storage._signed_url_cache] == ["b.docx", "c.docx"]